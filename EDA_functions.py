@@ -1,14 +1,57 @@
 import pandas as pd
 import numpy as np
-import plotly.express as px
-import plotly.figure_factory as ff
 from pandas.api.types import CategoricalDtype
-from PIL import Image
+
+# plotly is imported by the functions that draw, so that importing this module (i.e. for aggregate) stays cheap.
+
+
+# histogram functions used by the dashboard, mapped to their pandas aggregations:
+HISTFUNCS = {'count': 'count', 'sum': 'sum', 'avg': 'mean'}
+
+# scatters with more points than this are drawn with webgl (Scattergl):
+LARGE_DATA_POINTS = 2000
+# scatters with more points than this are drawn from a sample of them (the marginal boxes still summarize every point):
+MAX_SCATTER_POINTS = 5000
+# max marker diameter (in px) of sized scatters, as in px.scatter:
+SCATTER_SIZE_MAX = 20
+# number of bins per axis of the density heatmaps:
+HEATMAP_BINS = 30
+
+
+# the columns to group by, keeping missing values as a group of their own like plotly does. pandas (1.x) drops the
+# missing values of categorical keys even with dropna=False, so categoricals holding any are grouped as objects:
+def _group_keys(df, cols):
+    keys = []
+    for col in cols:
+        key = df[col]
+        if isinstance(key.dtype, CategoricalDtype) and key.isna().any():
+            key = key.astype(object)
+        keys.append(key)
+    return keys
+
+
+# aggregates the data server side, counting rows (y=None) or aggregating y with func for every x (and color) value,
+# missing x and color values included. returns the aggregated df and the name of its value column (labeled like
+# plotly's histograms, i.e. 'sum of y'):
+def aggregate(df, x, y=None, color=None, func='count'):
+    keys = _group_keys(df, [x] if color is None else [x, color])
+    if y is None:
+        value_col = 'count'
+        agg_df = df.groupby(keys, observed=True, sort=False, dropna=False).size()
+    else:
+        value_col = func + ' of ' + y
+        values = pd.to_numeric(df[y], errors='coerce')
+        agg_df = values.groupby(keys, observed=True, sort=False, dropna=False).agg(HISTFUNCS[func])
+
+    return agg_df.rename(value_col).reset_index(), value_col
 
 
 # plots histogram of x and y. Aggregates based on func (sum, avg, etc.):
 def histogram(df, x, y, func, w, h):
-    fig = px.histogram(df, x=x, y=y, histfunc=func, hover_data=df.columns)
+    import plotly.express as px
+
+    agg_df, value_col = aggregate(df, x, y, func=func)
+    fig = px.bar(agg_df, x=x, y=value_col)
     fig.update_layout(
         autosize=False,
         width=w,
@@ -18,7 +61,10 @@ def histogram(df, x, y, func, w, h):
 
 # plots histogram of x and count(x). Aggregates based on func (sum, avg, etc.):
 def count_histogram(df, x, color, w, h, array_l):
-    fig = px.histogram(df, x=x, color=color, hover_data=df.columns)
+    import plotly.express as px
+
+    agg_df, value_col = aggregate(df, x, color=color)
+    fig = px.bar(agg_df, x=x, y=value_col, color=color)
     fig.update_layout(
         autosize=False,
         width=w,
@@ -30,6 +76,8 @@ def count_histogram(df, x, color, w, h, array_l):
 
 # plots scatter matrix:
 def scatter_matrix(df, category, dims, w, h):
+    import plotly.express as px
+
     fig = px.scatter_matrix(df, dimensions=dims, color=category)
     fig.update_layout(
         autosize=False,
@@ -40,6 +88,8 @@ def scatter_matrix(df, category, dims, w, h):
 
 # plots scatter strip with hue:
 def strip_plot(df, x, y, hue, w, h):
+    import plotly.express as px
+
     fig = px.strip(df, x=x, y=y, color=hue)
     fig.update_layout(
         autosize=False,
@@ -50,6 +100,8 @@ def strip_plot(df, x, y, hue, w, h):
 
 # plots day of the week heatmap (only work of datetimes have been converted to day of week):
 def day_of_week_heatmap(df, y, w, h):
+    import plotly.express as px
+
     cats = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
     cat_type = CategoricalDtype(categories=cats, ordered=True)
     df['workout: day of week'] = df['workout: day of week'].astype(cat_type)
@@ -62,16 +114,103 @@ def day_of_week_heatmap(df, y, w, h):
     return fig
 
 
-def heatmap(df, x, y, w, h):
-    fig = px.density_heatmap(df, x=x, y=y, marginal_x="histogram", marginal_y="histogram")
+# lays out a main plot with marginal plots above (x) and to the right (y) of it, like plotly express' marginals:
+def marginal_subplots():
+    from plotly.subplots import make_subplots
+
+    return make_subplots(rows=2, cols=2, column_widths=[0.74, 0.26], row_heights=[0.26, 0.74], shared_xaxes=True,
+                         shared_yaxes=True, horizontal_spacing=0.005, vertical_spacing=0.005)
+
+
+# summary statistics of a box plot (quartiles and 1.5 IQR whisker fences), computed server side so that the browser
+# draws the box without the raw values. returns None for an empty array:
+def box_stats(values):
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return None
+    q1, median, q3 = np.percentile(values, [25, 50, 75])
+    iqr = q3 - q1
+    return {'q1': [q1], 'median': [median], 'q3': [q3],
+            'lowerfence': [values[values >= q1 - 1.5 * iqr].min()],
+            'upperfence': [values[values <= q3 + 1.5 * iqr].max()]}
+
+
+# plots a density heatmap of x vs. y with histograms of both in the margins. the counts are binned server side with
+# numpy, so the figure holds bins x bins counts instead of every row:
+def heatmap(df, x, y, w, h, bins=HEATMAP_BINS):
+    import plotly.express as px
+    import plotly.graph_objects as go
+
+    values = df[[x, y]].apply(pd.to_numeric, errors='coerce').dropna()
+    counts, x_edges, y_edges = np.histogram2d(values[x].to_numpy(dtype=float), values[y].to_numpy(dtype=float),
+                                              bins=bins)
+    x_centers = (x_edges[:-1] + x_edges[1:]) / 2
+    y_centers = (y_edges[:-1] + y_edges[1:]) / 2
+    marginal_color = px.colors.qualitative.Plotly[0]
+
+    fig = marginal_subplots()
+    fig.add_trace(go.Heatmap(x=x_centers, y=y_centers, z=counts.T, coloraxis='coloraxis',
+                             hovertemplate=x + '=%{x}<br>' + y + '=%{y}<br>count=%{z}<extra></extra>'), row=2, col=1)
+    fig.add_trace(go.Bar(x=x_centers, y=counts.sum(axis=1), width=np.diff(x_edges), marker_color=marginal_color,
+                         showlegend=False, hovertemplate=x + '=%{x}<br>count=%{y}<extra></extra>'), row=1, col=1)
+    fig.add_trace(go.Bar(x=counts.sum(axis=0), y=y_centers, width=np.diff(y_edges), orientation='h',
+                         marker_color=marginal_color, showlegend=False,
+                         hovertemplate=y + '=%{y}<br>count=%{x}<extra></extra>'), row=2, col=2)
+    fig.update_xaxes(title_text=x, row=2, col=1)
+    fig.update_yaxes(title_text=y, row=2, col=1)
     fig.update_layout(
+        coloraxis=dict(colorbar=dict(title='count')),
+        bargap=0,
         autosize=False,
         width=w,
         height=h)
     return fig
 
 
-
-
-
-    
+# plots the classes of an instructor as a scatter of x vs. y (sized by size), with box plots of both in the margins.
+# the boxes are summarized server side, and large scatters are drawn with webgl from a sample of at most max_points:
+def class_scatter(df, x, y, size, color, hover_data, title, tickvals, w, h, max_points=MAX_SCATTER_POINTS):
+    import plotly.express as px
+    import plotly.graph_objects as go
+
+    scatter_df = df.sample(n=max_points, random_state=0).sort_index() if len(df) > max_points else df
+    scatter = go.Scattergl if len(scatter_df) > LARGE_DATA_POINTS else go.Scatter
+    sizes = pd.to_numeric(df[size], errors='coerce')
+    sizeref = 2 * sizes.max() / SCATTER_SIZE_MAX ** 2 if sizes.max() > 0 else 1
+    hovertemplate = (color + '=%{meta}<br>' +
+                     '<br>'.join(col + '=%{customdata[' + str(i) + ']}' for i, col in enumerate(hover_data)) +
+                     '<extra></extra>')
+    colors = px.colors.qualitative.Plotly
+
+    fig = marginal_subplots()
+    groups = df.groupby(color, observed=True, sort=False)
+    for i, (group, group_df) in enumerate(groups):
+        group_color = colors[i % len(colors)]
+        points_df = scatter_df.loc[scatter_df.index.intersection(group_df.index)]
+        fig.add_trace(scatter(x=points_df[x], y=points_df[y], mode='markers', name=str(group), legendgroup=str(group),
+                              meta=str(group), customdata=points_df[hover_data].to_numpy(),
+                              hovertemplate=hovertemplate,
+                              marker=dict(color=group_color, size=points_df[size], sizemode='area', sizeref=sizeref,
+                                          line=dict(width=0))),
+                      row=2, col=1)
+
+        x_stats = box_stats(pd.to_numeric(group_df[x], errors='coerce').to_numpy(dtype=float))
+        if x_stats is not None:
+            fig.add_trace(go.Box(y=[str(group)], orientation='h', name=str(group), legendgroup=str(group),
+                                 marker_color=group_color, showlegend=False, **x_stats), row=1, col=1)
+        y_stats = box_stats(pd.to_numeric(group_df[y], errors='coerce').to_numpy(dtype=float))
+        if y_stats is not None:
+            fig.add_trace(go.Box(x=[str(group)], name=str(group), legendgroup=str(group), marker_color=group_color,
+                                 showlegend=False, **y_stats), row=2, col=2)
+
+    fig.update_xaxes(title_text=x, tickvals=tickvals, row=2, col=1)
+    fig.update_yaxes(title_text=y, row=2, col=1)
+    fig.update_yaxes(showticklabels=False, row=1, col=1)
+    fig.update_xaxes(showticklabels=False, row=2, col=2)
+    fig.update_layout(
+        title_text=title,
+        legend_title_text=color,
+        autosize=False,
+        width=w,
+        height=h)
+    return fig
@@ -1,133 +1,568 @@
 import pandas as pd
 import requests
-import streamlit as st
-from datetime import datetime
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import threading
+import time
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from feature_engineering_functions import *
-
-# initiate session:
-# you will need to supply your own credentials below:
-s = requests.Session()
-payload = {'username_or_email':'your_username', 'password':'your_password'}
-s.post('https://api.onepeloton.com/auth/login', json=payload)
-
-
-# convert unix dates to readable date format i.e. "2021-03-14 08:33":
+from cache_functions import ResponseCache
+from cursor_functions import FeedCursor, CURSOR_DIR
+from database_functions import ensure_class_database, CLASS_DATABASE
+from instrumentation_functions import record_request, log_metrics
+from class_data_functions import *
+
+# base url of the api. point it at another server (i.e. the mock api in benchmarks/) with the PELOTON_API_URL
+# environment variable:
+API_URL = os.environ.get('PELOTON_API_URL', 'https://api.onepeloton.com').rstrip('/')
+
+# max number of concurrent requests made by the crawlers:
+MAX_WORKERS = 8
+# number of processes the instructor syncs are sharded across (each making up to MAX_WORKERS concurrent requests, so
+# keep it small against the real api):
+SYNC_PROCESSES = int(os.environ.get('PELOTON_SYNC_PROCESSES', 2))
+# retry settings for rate limited (429) and failed (5xx) requests:
+MAX_RETRIES = 5
+BACKOFF_SECS = 1
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# seconds to wait for the server to connect and to send data (requests that time out are retried like 5xx errors):
+REQUEST_TIMEOUT_SECS = 30
+
+# on-disk response cache (set CACHE_PATH to None to disable it):
+CACHE_PATH = './data/.api_cache.sqlite'
+CACHE_MAX_BYTES = 256 * 1024 ** 2
+# how long responses from each endpoint are cached for, in seconds (None = forever). endpoints not listed here, like
+# the paginated class and workout lists, are never cached:
+CACHE_TTLS = [
+    (r'/api/workout/[^/?]+$', None),
+    (r'/api/instructor/[^/?]+$', 7 * 24 * 3600),
+    (r'/api/instructor\?', 24 * 3600),
+    (r'/api/ride/metadata_mappings$', 24 * 3600),
+]
+
+# profiles of every instructor seen so far:
+INSTRUCTORS_CSV = './data/instructor_data/complete_instructors_list.csv'
+# workouts taken by every instructor, one csv per instructor:
+INSTRUCTOR_WORKOUTS_DIR = './data/instructor_data/instructor_workouts/'
+# checkpoints of a get_class_data crawl, kept in the crawl's directory until every slug is done:
+CRAWL_DIR_NAME = '.crawl'
+
+# you will need to supply your own credentials, either below or through the PELOTON_USERNAME and PELOTON_PASSWORD
+# environment variables:
+payload = {'username_or_email': os.environ.get('PELOTON_USERNAME', 'your_username'),
+           'password': os.environ.get('PELOTON_PASSWORD', 'your_password')}
+# the session cookies of the last login are saved here (readable by the owner only), so that other processes reuse the
+# session instead of logging in again. set PELOTON_SESSION_PATH to an empty string to disable it:
+SESSION_PATH = os.environ.get('PELOTON_SESSION_PATH', './data/.peloton_session.json')
+
+# the session is only created (and logged in) by the first request, see get_session():
+_session = None
+_session_lock = threading.Lock()
+# number of logins made by this process, so that workers rejected with the same cookies only log in again once:
+_login_count = 0
+
+# the response cache is opened by the first request that can use it, see get_response_cache():
+response_cache = None
+_response_cache_lock = threading.Lock()
+
+# time (unix) until which all workers hold off after any of them gets rate limited. it is kept in shared memory, and
+# the sync worker processes get their parent's (see init_sync_worker), so that a 429 holds off every process:
+_backoff_until = multiprocessing.Value('d', 0.0)
+
+# number of requests made by this process (retries included), for the sync reports:
+_request_lock = threading.Lock()
+requests_made = 0
+
+
+# reads the cookies saved by the last login to this api with these credentials (None if there are none):
+def read_saved_session():
+    if not SESSION_PATH:
+        return None
+    try:
+        with open(SESSION_PATH) as f:
+            saved = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if saved.get('api_url') != API_URL or saved.get('username') != payload['username_or_email']:
+        return None
+    return saved.get('cookies')
+
+
+# saves the cookies of a session atomically, with owner only permissions:
+def save_session(session):
+    if not SESSION_PATH:
+        return
+    os.makedirs(os.path.dirname(SESSION_PATH) or '.', exist_ok=True)
+    tmp_path = SESSION_PATH + '.' + str(os.getpid()) + '.tmp'
+    with os.fdopen(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+        json.dump({'api_url': API_URL, 'username': payload['username_or_email'], 'saved_at': time.time(),
+                   'cookies': requests.utils.dict_from_cookiejar(session.cookies)}, f)
+    os.replace(tmp_path, SESSION_PATH)
+
+
+# logs a session in (replacing any cookies it had) and saves its cookies for other processes:
+def login(session):
+    global _login_count
+    session.cookies.clear()
+    response = session.post(API_URL + '/auth/login', json=payload)
+    _login_count += 1
+    if response.ok:
+        save_session(session)
+    return response
+
+
+# returns the session shared by every request. it is created on first use, reusing the session saved by a previous
+# login when there is one, and logging in otherwise:
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                # size the connection pool so that every worker thread reuses its own keep-alive connection:
+                adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                saved_cookies = read_saved_session()
+                if saved_cookies:
+                    session.cookies.update(saved_cookies)
+                else:
+                    login(session)
+                _session = session
+    return _session
+
+
+# logs in again after the api rejected the session (i.e. the saved session expired). logins_seen is the login count
+# when the rejected request was made, so that a login made by another worker in the meantime is not repeated:
+def relogin(session, logins_seen):
+    with _session_lock:
+        if _login_count == logins_seen:
+            login(session)
+
+
+# returns the response cache, opening it on first use (None when CACHE_PATH is unset):
+def get_response_cache():
+    global response_cache
+    if response_cache is None and CACHE_PATH:
+        with _response_cache_lock:
+            if response_cache is None:
+                os.makedirs(os.path.dirname(CACHE_PATH) or '.', exist_ok=True)
+                response_cache = ResponseCache(CACHE_PATH, CACHE_MAX_BYTES)
+    return response_cache
+
+
+# hit/miss counters of the response cache, or None if it has not been used:
+def response_cache_stats():
+    return response_cache.stats() if response_cache is not None else None
+
+
+# returns how long the response of a url may be cached for (None = forever, 0 = not cached):
+def cache_ttl(url, data=None):
+    for pattern, ttl in CACHE_TTLS:
+        if re.search(pattern, url):
+            # workouts are immutable once finished, in progress ones are not cached:
+            if ttl is None and isinstance(data, dict) and data.get('status', 'COMPLETE') != 'COMPLETE':
+                return 0
+            return ttl
+    return 0
+
+
+# raised when a request fails for good: any status other than 2xx/304 once the retries (and the relogin) are spent, or
+# no response at all. status is the http status of the last response (None when there was none):
+class PelotonAPIError(Exception):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+# get a url and return its json. backs off exponentially (or as told by 'Retry-After') on 429s, 5xx errors and
+# timeouts, and logs in again once if the session was rejected (401). raises PelotonAPIError for any response that is
+# not a 2xx/304 once the retries and relogin are spent, rather than passing the error body on as data. cacheable
+# endpoints are served from the response cache while fresh, and revalidated with the server once stale:
+def get_json(url):
+    global requests_made
+    cached = None
+    cache = get_response_cache() if cache_ttl(url) != 0 else None
+    if cache is not None:
+        cached = cache.lookup(url)
+        if cached is not None and cached['fresh']:
+            return json.loads(cached['body'])
+
+    session = get_session()
+    relogged = False
+    delay = BACKOFF_SECS
+    for attempt in range(MAX_RETRIES + 1):
+        # wait out any backoff triggered by another worker:
+        wait = _backoff_until.value - time.time()
+        if wait > 0:
+            time.sleep(wait)
+
+        logins_seen = _login_count
+        started = time.perf_counter()
+        try:
+            response = session.get(url, headers=ResponseCache.validators(cached), timeout=REQUEST_TIMEOUT_SECS)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            response, error = None, e
+        else:
+            record_request(url, response, time.perf_counter() - started)
+            error = None
+        with _request_lock:
+            requests_made += 1
+        if response is not None and response.status_code == 401 and not relogged:
+            relogin(session, logins_seen)
+            relogged = True
+            continue
+        if response is not None and response.status_code not in RETRY_STATUS_CODES:
+            break
+        if attempt == MAX_RETRIES:
+            failure = repr(error) if response is None else str(response.status_code)
+            raise PelotonAPIError(f"{url}: {failure} after {MAX_RETRIES} retries",
+                                  None if response is None else response.status_code)
+
+        retry_after = response.headers.get('Retry-After', '') if response is not None else ''
+        pause = float(retry_after) if retry_after.isdigit() else delay * (1 + random.random())
+        with _backoff_until.get_lock():
+            _backoff_until.value = max(_backoff_until.value, time.time() + pause)
+        delay *= 2
+
+    # not modified since it was cached:
+    if response.status_code == 304 and cached is not None:
+        data = json.loads(cached['body'])
+        cache.refresh(url, cache_ttl(url, data))
+        return data
+    if not 200 <= response.status_code < 300:
+        raise PelotonAPIError(f"{url}: {response.status_code} {response.text[:200]}", response.status_code)
+
+    data = response.json()
+    if cache is not None and response.status_code == 200:
+        ttl = cache_ttl(url, data)
+        if ttl != 0:
+            cache.store(url, response.content, response.headers, ttl)
+    return data
+
+
+# get a list of urls concurrently and return their json in the same order:
+def get_json_many(urls, max_workers=MAX_WORKERS):
+    urls = list(urls)
+    if len(urls) <= 1 or max_workers <= 1:
+        return [get_json(url) for url in urls]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(urls))) as pool:
+        return list(pool.map(get_json, urls))
+
+
+# get every page of a paginated endpoint. page 0 gives the page count, the remaining pages are fetched concurrently:
+def get_all_pages(url, max_workers=MAX_WORKERS):
+    first_page = get_json(url + '&page=0')
+    page_count = first_page['page_count']
+    page_urls = [url + '&page=' + str(page_num) for page_num in range(1, page_count + 1)]
+
+    return [first_page] + get_json_many(page_urls, max_workers)
+
+
+# yield pages in order (from page start on), fetching them concurrently max_workers at a time so that callers can stop
+# early:
+def iter_pages(url, page_count, max_workers=MAX_WORKERS, start=0):
+    for window_start in range(start, page_count + 1, max_workers):
+        window = range(window_start, min(window_start + max_workers, page_count + 1))
+        for page in get_json_many([url + '&page=' + str(page_num) for page_num in window], max_workers):
+            yield page
+
+
+# convert unix dates to readable date format i.e. "2021-03-14 08:33" (NaN where missing):
 def unix_date_converter(date_series):
-    for i, unix_ts in enumerate(date_series):
-        date_series[i] = datetime.utcfromtimestamp(date_series[i]).strftime('%Y-%m-%d %H:%M')
-    return date_series
-
+    seconds = np.asarray(date_series, dtype='float64')
+    # missing (and otherwise non-finite) times stay missing:
+    found = np.isfinite(seconds)
+    dates = np.full(len(seconds), np.nan, dtype=object)
+    minutes = seconds[found].astype('int64').astype('datetime64[s]').astype('datetime64[m]')
+    dates[found] = np.char.replace(np.datetime_as_string(minutes, unit='m'), 'T', ' ')
+    return dates
+
+
+# collects raw page records and builds the dataframe once at the end, instead of concatenating a new dataframe for
+# every page (which copies everything collected so far on each page):
+class RecordAccumulator:
+    def __init__(self):
+        self.records = []
+
+    def add(self, records):
+        self.records.extend(records)
+
+    def finish(self):
+        return pd.DataFrame.from_records(self.records)
+
+
+# checkpoint journal of a crawl: an append-only json lines file with a line per checkpoint, either pages fetched (and
+# the part file their records were written to) or a slug finished. every line is flushed to disk before the crawl goes
+# on, and a line torn by a crash is ignored, so that a restarted crawl resumes from the last checkpoint:
+class CrawlJournal:
+    def __init__(self, crawl_dir):
+        self.crawl_dir = crawl_dir
+        self.path = os.path.join(crawl_dir, 'journal.jsonl')
+        # slug -> pages fetched, slug -> {first page: part file}, and the slugs finished:
+        self.pages = {}
+        self.parts = {}
+        self.done = set()
+        os.makedirs(crawl_dir, exist_ok=True)
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        self._apply(json.loads(line))
+                    except ValueError:
+                        pass
+        except FileNotFoundError:
+            pass
 
-# get a dataframe of all instructors plus their quotes, hero pictures, etc:
-@st.experimental_singleton()
+    def _apply(self, entry):
+        slug = entry['slug']
+        if entry.get('done'):
+            self.done.add(slug)
+            return
+        self.pages.setdefault(slug, set()).update(entry['pages'])
+        if entry.get('part'):
+            self.parts.setdefault(slug, {})[min(entry['pages'])] = entry['part']
+
+    def record(self, entry):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._apply(entry)
+
+    # the part files of a slug, in page order:
+    def part_paths(self, slug):
+        parts = self.parts.get(slug, {})
+        return [os.path.join(self.crawl_dir, parts[first_page]) for first_page in sorted(parts)]
+
+
+# combines the part files of a crawled slug into a single csv, in page order, with the columns of every part and
+# without the records repeated across parts (pages shift when classes are added during a crawl). values are copied as
+# text, a part at a time:
+def combine_crawl_parts(part_paths, path):
+    columns = list(dict.fromkeys(col for part_path in part_paths for col in pd.read_csv(part_path, nrows=0).columns))
+    if not columns:
+        return
+    tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+    seen_ids = set()
+    pd.DataFrame(columns=columns).to_csv(tmp_path, index=None)
+    for part_path in part_paths:
+        part_df = pd.read_csv(part_path, dtype=str, keep_default_na=False)
+        if 'id' in part_df:
+            part_df = part_df[~part_df['id'].isin(seen_ids)].drop_duplicates(subset=['id'])
+            seen_ids.update(part_df['id'])
+        part_df.reindex(columns=columns, fill_value='').to_csv(tmp_path, mode='a', header=False, index=None)
+    os.replace(tmp_path, path)
+
+
+# returns the records of a feed (paged newest first) that are not saved yet, along with the feed's total. pages are
+# read only until they get past the cursor's window. when the feed grew by more records than were found that way,
+# records were backfilled further back than the window, and every page is read instead, keeping the records whose id
+# is not in read_saved_ids(). callers move the cursor past the records once they are saved:
+def get_feed_diff(url, cursor, read_saved_ids, max_workers=MAX_WORKERS):
+    # page 0 also gives the page count and total, the pages after it are fetched as needed:
+    first_page = get_json(url + '&page=0')
+    page_count = first_page['page_count']
+
+    new_records = []
+    for page_records in itertools.chain([first_page], iter_pages(url, page_count, max_workers, start=1)):
+        page_new_records, past_window = cursor.split_page(page_records['data'])
+        new_records.extend(page_new_records)
+        if past_window:
+            break
+
+    total = first_page.get('total')
+    if total is not None and cursor.total is not None and total > cursor.total + len(new_records):
+        print(f"{cursor.feed}: {total - cursor.total - len(new_records)} records backfilled, reading every page")
+        saved_ids = read_saved_ids()
+        new_records = [record for page_records in itertools.chain([first_page],
+                                                                  iter_pages(url, page_count, max_workers, start=1))
+                       for record in page_records['data'] if record['id'] not in saved_ids]
+
+    # records added while the pages are read shift the pages, repeating records at their edges:
+    new_records = list({record['id']: record for record in new_records}.values())
+
+    return new_records, total
+
+
+# get a dataframe of all instructors plus their quotes, hero pictures, etc (fetched once per process):
+@lru_cache(maxsize=None)
 def get_instructors_data():
-    instructors = s.get('https://api.onepeloton.com/api/instructor?limit=100').json()
+    instructors = get_json(API_URL + '/api/instructor?limit=100')
     instructors_df = pd.DataFrame.from_dict(instructors['data'])
 
     return instructors_df
 
 
-# return a csv for every workout category and all of its classes:
-def get_class_data(dir_path):
+# return a csv for every workout category and all of its classes. the crawl is checkpointed every max_workers pages
+# (see CrawlJournal): the records fetched are written to a part file, and combined into the slug's csv once every page
+# of the slug is in. a crawl that was stopped (i.e. by a network failure) resumes from its last checkpoint when called
+# again, skipping the slugs and pages already done:
+def get_class_data(dir_path, max_workers=MAX_WORKERS):
     # get a list of all workout categories:
-    wo_categories = s.get('https://api.onepeloton.com/api/v2/ride/archived?browse_category=cycling&page=0').json()
+    wo_categories = get_json(API_URL + '/api/v2/ride/archived?browse_category=cycling&page=0')
     categories_df = pd.DataFrame.from_dict(wo_categories['browse_categories'])
 
-    # for each class category (saved as a 'slug' in peloton's lingo), get the total number of pages worth of classes:
-    for slug in categories_df['slug']:
-        wo_url = 'https://api.onepeloton.com/api/v2/ride/archived?browse_category=' + str(slug)
-        page_count = s.get(wo_url).json()['page_count']
-
-        # for each page, get all the classes and append the results to the previous page:
-        slug_df = pd.DataFrame()
-        for page_num in range(page_count + 1):
-            page_url = wo_url + '&page=' + str(page_num)
-            page_classes = s.get(page_url).json()
-            slug_df = pd.concat([slug_df, pd.DataFrame.from_dict(page_classes['data'])])
+    # TODO: ensure dir_path contains '/'
+    crawl_dir = dir_path + CRAWL_DIR_NAME
+    journal = CrawlJournal(crawl_dir)
 
-        # after all pages have been iterated through, save final df to csv and free it from memory:
-        # TODO: ensure dir_path contains '/'
-        slug_df.to_csv(dir_path + slug + ".csv", index=None)
-        del slug_df
-
-
-# takes a df of instructor taken workouts and looks for the name of the instructors who conducted for said workouts:
-# TODO: add try except to replace the api call with file read for instructors
-def get_class_instructor_name(workouts_df, instructors_df):
-    instructor_names = []
+    # for each class category (saved as a 'slug' in peloton's lingo), get all of its pages worth of classes:
+    for slug in categories_df['slug']:
+        if slug in journal.done:
+            continue
+        wo_url = API_URL + '/api/v2/ride/archived?browse_category=' + str(slug)
+        os.makedirs(os.path.join(crawl_dir, slug), exist_ok=True)
+
+        # the page count is read again on every run, since classes keep being added to the slug:
+        page_count = get_json(wo_url + '&page=0')['page_count']
+        pages_left = [page_num for page_num in range(page_count + 1) if page_num not in journal.pages.get(slug, ())]
+
+        # fetch the pages left max_workers at a time, checkpointing the records of every batch:
+        for batch_start in range(0, len(pages_left), max_workers):
+            page_nums = pages_left[batch_start:batch_start + max_workers]
+            pages = get_json_many([wo_url + '&page=' + str(page_num) for page_num in page_nums], max_workers)
+            records = [record for page_classes in pages for record in page_classes['data']]
+            part = None
+            if records:
+                part = slug + '/' + str(page_nums[0]) + '.csv'
+                write_csv_atomically(pd.DataFrame.from_records(records), os.path.join(crawl_dir, part))
+            journal.record({'slug': slug, 'pages': page_nums, 'part': part})
+
+        combine_crawl_parts(journal.part_paths(slug), dir_path + slug + '.csv')
+        journal.record({'slug': slug, 'done': True})
+        shutil.rmtree(os.path.join(crawl_dir, slug), ignore_errors=True)
+
+    # the crawl is complete, so the next one starts over:
+    shutil.rmtree(crawl_dir, ignore_errors=True)
+
+
+# get the profiles of the given instructor ids concurrently:
+def get_instructor_profiles(instructor_ids, max_workers=MAX_WORKERS):
+    instructor_urls = [API_URL + '/api/instructor/' + str(instructor_id) for instructor_id in instructor_ids]
+    return get_json_many(instructor_urls, max_workers)
+
+
+# returns the instructor id of a workout's ride, None for rides without an instructor (raises KeyError when the
+# workout has no ride at all):
+def get_workout_instructor_id(workout_data):
     try:
-        for workout_id in workouts_df['id']:
-            workout_data = s.get('https://api.onepeloton.com/api/workout/' + str(workout_id)).json()
-            try:
-                instructor_id = workout_data['ride']['instructor_id']
-                if instructor_id is not None:
-                    try:
-                        instructor_name = instructors_df.loc[instructors_df['id'] == instructor_id, 'name'].values[0]
-                        instructor_names.append(instructor_name)
-                    except (IndexError, KeyError) as e:    
-                        instructor_name = s.get('https://api.onepeloton.com/api/instructor/' + instructor_id).json()['name']
-                        instructor_names.append(instructor_name)
-                else:
-                    instructor_name = workout_data['name']
-                    instructor_names.append(instructor_name)
-            except KeyError as e:
-                instructor_name = workout_data['workout_type']
-                instructor_names.append(instructor_name)
-    except KeyError as e:
-        pass
+        return workout_data['ride']['instructor_id']
+    except TypeError as e:
+        raise KeyError('ride') from e
+
+
+# takes a df of instructor taken workouts and looks for the name of the instructors who conducted for said workouts.
+# every unique workout and unknown instructor is only requested once, and the requests are made concurrently:
+def get_class_instructor_name(workouts_df, instructors_df=None, max_workers=MAX_WORKERS):
+    if instructors_df is None:
+        instructors_df = get_instructors_data()
+    if 'id' not in workouts_df:
+        workouts_df['instructor_name'] = []
+        return workouts_df
+
+    # index instructor names by id once:
+    instructor_index = dict(zip(instructors_df['id'], instructors_df['name']))
+
+    # get every unique workout:
+    workout_ids = list(dict.fromkeys(workouts_df['id']))
+    workout_urls = [API_URL + '/api/workout/' + str(workout_id) for workout_id in workout_ids]
+    workouts = dict(zip(workout_ids, get_json_many(workout_urls, max_workers)))
+
+    # get the instructors that are not in the index:
+    missing_ids = set()
+    for workout_data in workouts.values():
+        try:
+            instructor_id = get_workout_instructor_id(workout_data)
+        except KeyError as e:
+            continue
+        if instructor_id is not None and instructor_id not in instructor_index:
+            missing_ids.add(instructor_id)
+    missing_ids = list(missing_ids)
+    for instructor_id, profile in zip(missing_ids, get_instructor_profiles(missing_ids, max_workers)):
+        instructor_index[instructor_id] = profile.get('name')
+
+    # classes without an instructor fall back to the workout name, workouts without a ride to the workout type:
+    instructor_names = []
+    for workout_id in workouts_df['id']:
+        workout_data = workouts[workout_id]
+        try:
+            instructor_id = get_workout_instructor_id(workout_data)
+        except KeyError as e:
+            instructor_names.append(workout_data.get('workout_type'))
+            continue
+        if instructor_id is not None:
+            instructor_names.append(instructor_index[instructor_id])
+        else:
+            instructor_names.append(workout_data.get('name'))
 
     workouts_df['instructor_name'] = instructor_names
     return workouts_df
 
 
 # return all publicly available workouts for an instructor:
-def get_instructor_workouts(user_id):
+def get_instructor_workouts(user_id, max_workers=MAX_WORKERS):
     # TODO: add ability to perform diff and always get latest workouts:
-    wo_url = 'https://api.onepeloton.com/api/user/' + str(user_id) + '/workouts?limit=100'
-    wo_df = pd.DataFrame()
+    wo_url = API_URL + '/api/user/' + str(user_id) + '/workouts?limit=100'
+    wo_records = RecordAccumulator()
     try:
-        page_count = s.get(wo_url).json()['page_count']
-
-        for page_num in range(page_count + 1):
-            page_url = wo_url + '&page=' + str(page_num)
-            page_classes = s.get(page_url).json()
-            wo_df = pd.concat([wo_df, pd.DataFrame.from_dict(page_classes['data'])])
-    except KeyError as e:
+        for page_classes in get_all_pages(wo_url, max_workers):
+            wo_records.add(page_classes['data'])
+    except PelotonAPIError as e:
+        # private profiles are forbidden (403), anything else is a failure of the sync:
+        if e.status != 403:
+            raise
         print('Workout data for this instructor is not publicly available.')
-    wo_df = get_class_instructor_name(wo_df)
+    wo_df = wo_records.finish()
+    wo_df = get_class_instructor_name(wo_df, max_workers=max_workers)
 
     return wo_df
 
 
-# pull workout data for all available peloton instructors and save them as individual files for each instructor:
-def get_all_instructors_workouts(path_to_dir):
+# pull the workouts of an instructor and save them to the instructor's file. returns the number of workouts saved:
+def save_instructor_workouts(user_id, instructors_df, path_to_dir, max_workers=MAX_WORKERS):
+    wo_df = get_instructor_workouts(user_id, max_workers)
+    instructor_name = (instructors_df.loc[instructors_df['user_id'] == user_id, 'name'].values[0]).replace(' ', '_')
+    file_name = path_to_dir + '/' + instructor_name + '.csv'
+    write_csv_atomically(wo_df, file_name, index=None)
+
+    return len(wo_df)
+
+
+# pull workout data for all available peloton instructors and save them as individual files for each instructor,
+# sharded across processes. returns the run report (see run_instructor_syncs):
+def get_all_instructors_workouts(path_to_dir, max_workers=MAX_WORKERS, processes=SYNC_PROCESSES):
     # TODO: change API call to file read (./data/complete_instructors.csv)
     instructors_df = get_instructors_data()
 
-    for user_id in instructors_df['user_id']:
-        wo_df = get_instructor_workouts(user_id)
-        instructor_name = (instructors_df.loc[instructors_df['user_id'] == user_id, 'name'].values[0]).replace(' ', '_')
-        file_name = path_to_dir + '/' + instructor_name + '.csv'
-        wo_df.to_csv(file_name)
+    return run_instructor_syncs(save_instructor_workouts, instructors_df, processes, instructors_df, path_to_dir,
+                                max_workers)
 
 
-# get device type mappings:
-@st.experimental_memo()
+# get device type mappings (fetched once per process):
+@lru_cache(maxsize=None)
 def get_device_type_mappings():
-    device_types = s.get('https://api.onepeloton.com/api/ride/metadata_mappings').json()['device_type_display_names']
+    device_types = get_json(API_URL + '/api/ride/metadata_mappings')['device_type_display_names']
     device_types_df = pd.DataFrame.from_dict(device_types)
 
     return device_types_df
 
 
 # preprocess class data:
-def preprocess_classes_data(diff_df):
+def preprocess_classes_data(diff_df, max_workers=MAX_WORKERS):
     # get list of instructors and their profile data:
-    instructors = pd.read_csv('./data/instructor_data/complete_instructors_list.csv')
+    instructors = pd.read_csv(INSTRUCTORS_CSV)
 
     # convert unix time to datetime:
     diff_df['original_airtime'] = unix_date_converter(diff_df['original_air_time'])
-    diff_df['instructor_name'] = pd.Series()
+    diff_df['original_air_time'] = diff_df['original_airtime']
     
     # convert to day of week:
     diff_df['workout: day of week'] = pd.to_datetime(diff_df['original_airtime']).dt.day_name()
@@ -138,175 +573,226 @@ def preprocess_classes_data(diff_df):
     # get workout title:
     diff_df['workout: title'] = diff_df['title']
     
-    # get instructor name from ID:
-    try:
-        for i, instructor_id in enumerate(diff_df['instructor_id']):
-            try:
-                instructor_name = instructors.loc[instructors['id'] == instructor_id, 'name'].values[0]
-                diff_df['instructor_name'][i] = instructor_name
-            except (IndexError, KeyError) as e:
-                # if ID not found in instructors file, call the API, append the new record to the instructors
-                # file and save:
-                instructor_dict = s.get('https://api.onepeloton.com/api/instructor/' + str(instructor_id)).json()
-                new_instructor_df = pd.DataFrame([instructor_dict])
-                instructor_name = instructor_dict['name']
-                instructors = pd.concat([instructors, new_instructor_df])
-                diff_df['instructor_name'][i] = instructor_name
-    except (IndexError, KeyError) as e:
-        pass
-
-    # save any new records to the main instructors file:
-    instructors.to_csv('./data/instructor_data/complete_instructors_list.csv', index=None)
+    # get instructor name from ID, through an id -> name index of the instructors file:
+    instructor_ids = diff_df['instructor_id'] if 'instructor_id' in diff_df else pd.Series(index=diff_df.index,
+                                                                                            dtype=object)
+    instructor_names = instructors.drop_duplicates(subset=['id']).set_index('id')['name']
+
+    # if IDs are not found in instructors file, get them all from the API at once, append the new records to the
+    # instructors file and save it:
+    missing_ids = list(set(instructor_ids.dropna()) - set(instructor_names.index))
+    new_instructors = [profile for profile in get_instructor_profiles(missing_ids, max_workers) if 'name' in profile]
+    if new_instructors:
+        new_instructors_df = pd.DataFrame(new_instructors)
+        instructors = pd.concat([instructors, new_instructors_df], ignore_index=True)
+        write_csv_atomically(instructors, INSTRUCTORS_CSV)
+        instructor_names = pd.concat([instructor_names, new_instructors_df.set_index('id')['name']])
+
+    diff_df['instructor_name'] = instructor_ids.map(instructor_names)
     
     return diff_df
 
 
-# find the latest classes and add them to the master file with all classes:
-def get_class_diff():
+# find the latest classes and append them to the class store as a new delta segment. only the classes newer than the
+# cursor's window are read (see get_feed_diff), so the cost of a sync does not grow with the archive:
+def get_class_diff(max_workers=MAX_WORKERS, store_dir=CLASS_STORE_DIR):
     # get a list of all workout categories:
-    wo_categories = s.get('https://api.onepeloton.com/api/v2/ride/archived?browse_category=cycling&page=0').json()
+    wo_categories = get_json(API_URL + '/api/v2/ride/archived?browse_category=cycling&page=0')
     categories_df = pd.DataFrame.from_dict(wo_categories['browse_categories'])
     
-    # read master file with saved classes up to date:
-    # master_df = pd.read_csv('./data/class_data/master_classes.csv', low_memory=False)
-    master_df = pd.read_csv('/Users/walter/Desktop/PELOTON_DATA/classes_data/master_classes.csv', low_memory=False)
-    master_slug_ids_set = set(master_df['id'])
-    
-    # set empty df to contain the difference in records (new classes not in master file):
-    diff_df = pd.DataFrame()
+    # the cursor of the classes saved up to date (the store is built from the master csv on first use). it is started
+    # over from the store when the store was replaced since the last sync:
+    ensure_class_store(store_dir=store_dir)
+    cursor = FeedCursor('classes', 'original_air_time', CURSOR_DIR)
+    if not cursor.matches(class_store_source(store_dir)):
+        cursor.reset(*read_class_air_times(store_dir))
     
     # get the top url for all rides:
-    rides_url = 'https://api.onepeloton.com/api/v2/ride/archived?browse_category&limit=100'
+    rides_url = API_URL + '/api/v2/ride/archived?browse_category&limit=100'
 
-    # get the total number of class pages for the category:
-    rides_dict = s.get(rides_url).json()
-    page_count = rides_dict['page_count']
-
-    # iterate through every page in until a class id in the master file is found:
-    found = False
-    try:
-        for page_num in range(page_count + 1):
-            print(page_num)
-            # get url for category and specific page number:
-            page_url = rides_url + '&page=' + str(page_num)
-
-            #all classes in a given page:
-            page_classes_df = pd.DataFrame.from_dict(s.get(page_url).json()['data'])
-            for i, class_id in enumerate(page_classes_df['id']):
-                if class_id not in master_slug_ids_set:
-                    diff_df = pd.concat([diff_df, page_classes_df.iloc[[i]]])
-                else:
-                    print(f'class_id found in file: {class_id}')
-                    found = True
-                    break
-            if found:
-                break
-    except KeyError as e:
-        pass
+    # collect the difference in records (new classes not in the store), pages fetched max_workers at a time:
+    new_records, total = get_feed_diff(rides_url, cursor, lambda: read_class_ids(store_dir), max_workers)
+    print(f"new classes: {len(new_records)}")
 
     # check to see if there is any difference in the data:
-    if len(diff_df) != 0:
-        diff_df = diff_df.reset_index(drop=True)
+    if new_records:
+        diff_df = pd.DataFrame.from_records(new_records)
         
-        # preprocess diff_df before appending to master file:
-        preprocessed_diff_df = preprocess_classes_data(diff_df)
-        # return an updated master file:
-        updated_master_df = pd.concat([master_df, preprocessed_diff_df])
-        updated_master_df.drop_duplicates(subset=['id'], inplace=True)
-        updated_master_df.sort_values(by='original_airtime', ascending=False, inplace=True)
-
-        # check for number of records after:
-        # total_records_master = len(updated_master_df)
-        # total_rides_available = rides_dict['total']
-        # print(f"total records in master file: {total_records_master}")
-        # print(f"total rides available: {total_rides_available}")
-    else:
-        updated_master_df = master_df
-        pass
-    
-    # updated_master_df.to_csv('./data/class_data/master_classes.csv', index=None)
-    updated_master_df.to_csv('/Users/walter/Desktop/PELOTON_DATA/classes_data/master_classes.csv', index=None)
+        # preprocess diff_df and append it to the store:
+        preprocessed_diff_df = preprocess_classes_data(diff_df, max_workers)
+        append_class_segment(prepare_class_frame(preprocessed_diff_df), store_dir)
+    cursor.advance(new_records)
+    cursor.save(source=class_store_source(store_dir), total=total)
+
+    # bring the class database read by the dashboard up to date (before a compaction merges the new segment away):
+    ensure_class_database(store_dir, CLASS_DATABASE)
+
+    # merge the segments into the base once enough of them have piled up:
+    compact_class_store_in_background(store_dir)
+    log_metrics('get_class_diff',
+                caches={'response_cache': response_cache_stats()})
+
+
+# identifies the classes saved in a store, for the sync cursor: the store and its lineage, which only changes when the
+# store is replaced (appends and compactions keep it):
+def class_store_source(store_dir):
+    manifest = read_manifest(store_dir) or {}
+    return [os.path.abspath(store_dir), manifest.get('lineage')]
 
-# looks for differences between instructor taken classes available online, versus the ones on file:
-def get_instructor_workouts_diff(user_id, instructors_df):
+
+# identifies the contents of a file (its size and modification time), for the sync cursors:
+def file_source(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+# returns the cursor of an instructor's workouts file. an append to the file that was interrupted before the cursor
+# was saved is rolled back, and the cursor is started over from the file when anything else wrote it (i.e.
+# save_instructor_workouts):
+def instructor_workouts_cursor(user_id, workouts_path):
+    cursor = FeedCursor('workouts_' + str(user_id), 'created_at', CURSOR_DIR)
+    appending_from = cursor.state.pop('appending_from', None)
+    if appending_from is not None and os.path.getsize(workouts_path) > appending_from:
+        os.truncate(workouts_path, appending_from)
+        cursor.state['source'] = file_source(workouts_path)
+    if not cursor.matches(file_source(workouts_path)):
+        saved_workouts = pd.read_csv(workouts_path, usecols=['id', 'created_at']).dropna()
+        cursor.reset(saved_workouts['id'], saved_workouts['created_at'])
+
+    return cursor
+
+
+# looks for differences between instructor taken classes available online, versus the ones on file. new workouts are
+# appended to the file, and only the ones newer than the cursor's window are read (see get_feed_diff):
+def get_instructor_workouts_diff(user_id, instructors_df, max_workers=MAX_WORKERS):
     # get instructors list from API:
     instructors = instructors_df
     
     # get instructor name and prepare for file read:
     instructor_name = str(instructors.loc[instructors['user_id'] == user_id, 'name'].values[0]).replace(' ', '_')
     print(f"instructor name: {instructor_name}")
+    workouts_path = INSTRUCTOR_WORKOUTS_DIR + instructor_name + '.csv'
     
     # get page of workouts for specific instructors:
-    workout_url = 'https://api.onepeloton.com/api/user/' + str(user_id) + '/workouts?limit=100'
+    workout_url = API_URL + '/api/user/' + str(user_id) + '/workouts?limit=100'
     
     try:
-        # get file of already saved workouts for specific instructor:
-        instructor_workouts = pd.read_csv('./data/instructor_data/instructor_workouts/' + instructor_name + '.csv')
+        # get the cursor of the workouts already saved for the instructor:
+        cursor = instructor_workouts_cursor(user_id, workouts_path)
         
         try:
-            # class ids:
-            class_ids_lst = set(instructor_workouts['id'])
+            # collect all updates:
+            new_records, total = get_feed_diff(workout_url, cursor,
+                                               lambda: set(pd.read_csv(workouts_path, usecols=['id'])['id']),
+                                               max_workers)
+            diff_df = pd.DataFrame.from_records(new_records)
             
-            # get the total number of class pages for instructor workouts:
-            workout_dict = s.get(workout_url).json()
-            page_count = workout_dict['page_count']
+            if len(diff_df) != 0:
+                # get instructor names for each class taken in the diff dataframe:
+                diff_df = get_class_instructor_name(diff_df, instructors, max_workers)
+
+                # convert to timestamp:
+                diff_df['workout_timestamp'] = unix_date_converter(list(diff_df['created_at']))
+                # convert to day of week:
+                diff_df['workout: day of week'] = pd.to_datetime(diff_df['workout_timestamp']).dt.day_name()
+                # get time of day:
+                diff_df['workout: time of day'] = time_of_day(diff_df, 'workout_timestamp')
+                # get month and year i.e 'September 21'
+                diff_df['workout: month and year'] = month_of_year(diff_df, 'workout_timestamp')
+
+                # append diff df to the file on record, in the file's column order. the cursor notes where the file
+                # ended first, so that an interrupted append is rolled back by the next sync:
+                file_columns = pd.read_csv(workouts_path, nrows=0).columns
+                if set(diff_df.columns) <= set(file_columns):
+                    cursor.save(appending_from=os.path.getsize(workouts_path))
+                    diff_df.reindex(columns=file_columns).to_csv(workouts_path, mode='a', header=False, index=None)
+                    cursor.state.pop('appending_from')
+                else:
+                    # columns the file does not have yet mean rewriting the whole file, once:
+                    updated_workouts_df = pd.concat([pd.read_csv(workouts_path), diff_df])
+                    write_csv_atomically(updated_workouts_df, workouts_path)
 
-            # set empty df to all updates:
-            diff_df = pd.DataFrame()
+            cursor.advance(new_records)
+            cursor.save(source=file_source(workouts_path), total=total)
             
-            # check to see if class id exists in file, if found, break:
-            found = False
-            for page_num in range(page_count + 1):
-                # get page URL:
-                page_url = workout_url + '&page=' + str(page_num)
-                page_classes_df = pd.DataFrame.from_dict(s.get(page_url).json()['data'])
-                
-                # check every ID in the class page, and see if it exists alredy in file
-                for i, class_id in enumerate(page_classes_df['id']):
-                    if class_id not in class_ids_lst:
-                        diff_df = pd.concat([diff_df, page_classes_df.iloc[[i]]])
-                    else:
-                        found = True
-                        # print(f'class_id found in file: {class_id}')
-                        break
-                if found:
-                    break
-            
-            # get instructor names for each class taken in the diff dataframe:
-            diff_df = get_class_instructor_name(diff_df, instructors)
-
-            # convert to timestamp:
-            diff_df['workout_timestamp'] = unix_date_converter(list(diff_df['created_at']))
-            # convert to day of week:
-            diff_df['workout: day of week'] = pd.to_datetime(diff_df['workout_timestamp']).dt.day_name()
-            # get time of day:
-            diff_df['workout: time of day'] = time_of_day(diff_df, 'workout_timestamp')
-            # get month and year i.e 'September 21'
-            diff_df['workout: month and year'] = month_of_year(diff_df, 'workout_timestamp')
-            
-            # append diff df to file already on record:
-            updated_workouts_df = pd.concat([instructor_workouts, diff_df])
-            updated_workouts_df.drop_duplicates(subset=['id'], inplace=True)
-            
-            # save the updated df to file:
-            updated_workouts_df.to_csv('./data/instructor_data/instructor_workouts/' + instructor_name + '.csv', index=None)
-            
-            # return updated_workouts_df
-
-        except KeyError as e:
-            pass
+            # return the number of workouts added:
+            return len(diff_df)
+
+        except PelotonAPIError as e:
+            # private profiles are forbidden (403), anything else is a failure of the sync:
+            if e.status != 403:
+                raise
+            print('Workout data for this instructor is not publicly available.')
         
     except FileNotFoundError as e:
         print("File not Found")
         # TODO: if file is not found, look for instructor classes (if publicly available)
-        
-        
-# updates all instructor taken workouts:
-def update_instructor_workouts():
+
+
+# sets up a sync worker process: its own session (reusing the saved login) and response cache connection, and the
+# paths and backoff deadline of the parent process:
+def init_sync_worker(api_url, instructors_csv, instructor_workouts_dir, cursor_dir, session_path, cache_path,
+                     backoff_until):
+    global _session, response_cache, _backoff_until, API_URL, INSTRUCTORS_CSV, INSTRUCTOR_WORKOUTS_DIR, CURSOR_DIR, \
+        SESSION_PATH, CACHE_PATH
+    API_URL, INSTRUCTORS_CSV, INSTRUCTOR_WORKOUTS_DIR, CURSOR_DIR, SESSION_PATH, CACHE_PATH = (
+        api_url, instructors_csv, instructor_workouts_dir, cursor_dir, session_path, cache_path)
+    _session = None
+    response_cache = None
+    _backoff_until = backoff_until
+
+
+# runs the sync of one instructor, returning its row of the run report:
+def run_instructor_sync(sync, user_id, *args):
+    requests_before = requests_made
+    started = time.perf_counter()
+    row = {'user_id': user_id, 'pid': os.getpid()}
+    try:
+        rows_added = sync(user_id, *args)
+        row.update(status='ok' if rows_added is not None else 'skipped', error=None, rows_added=rows_added or 0)
+    except Exception as e:
+        row.update(status='failed', error=repr(e), rows_added=0)
+    row.update(requests=requests_made - requests_before, secs=round(time.perf_counter() - started, 3))
+
+    return row
+
+
+# runs sync(user_id, *args) for every instructor, sharded across processes (each with its own session). returns the
+# merged run report: a row per instructor with its status, rows added, requests made and time taken:
+def run_instructor_syncs(sync, instructors_df, processes, *args):
+    user_ids = list(instructors_df['user_id'])
+    started = time.perf_counter()
+    if processes <= 1 or len(user_ids) <= 1:
+        rows = [run_instructor_sync(sync, user_id, *args) for user_id in user_ids]
+    else:
+        # the session is logged in (and saved) up front, so that the workers reuse it instead of all logging in:
+        get_session()
+        worker_args = (API_URL, INSTRUCTORS_CSV, INSTRUCTOR_WORKOUTS_DIR, CURSOR_DIR, SESSION_PATH, CACHE_PATH,
+                       _backoff_until)
+        with ProcessPoolExecutor(max_workers=min(processes, len(user_ids)), initializer=init_sync_worker,
+                                 initargs=worker_args) as pool:
+            futures = [pool.submit(run_instructor_sync, sync, user_id, *args) for user_id in user_ids]
+            rows = [future.result() for future in futures]
+
+    names = dict(zip(instructors_df['user_id'], instructors_df['name']))
+    report = pd.DataFrame(rows, columns=['user_id', 'pid', 'status', 'error', 'rows_added', 'requests', 'secs'])
+    report.insert(1, 'instructor', report['user_id'].map(names))
+    print(f"synced {len(report)} instructors in {time.perf_counter() - started:.1f}s with {processes} process(es): "
+          f"{report['rows_added'].sum()} rows added, {report['requests'].sum()} requests, "
+          f"{(report['status'] == 'failed').sum()} failed")
+
+    return report
+
+
+# updates all instructor taken workouts, sharded across processes. returns the run report (see run_instructor_syncs):
+def update_instructor_workouts(max_workers=MAX_WORKERS, processes=SYNC_PROCESSES):
     # get list of instructors from API
     instructors_df = get_instructors_data()
     
-    # loop through every user_id and update the workout data:
-    for user_id in instructors_df['user_id']:
-        get_instructor_workouts_diff(user_id, instructors_df)
+    # update the workout data of every user_id:
+    report = run_instructor_syncs(get_instructor_workouts_diff, instructors_df, processes, instructors_df, max_workers)
+    log_metrics('update_instructor_workouts', report=report.drop(columns=['user_id']).to_dict('records'),
+                caches={'response_cache': response_cache_stats()})
+
+    return report
         
@@ -0,0 +1,189 @@
+import gc
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+from contextlib import closing
+import numpy as np
+from feature_engineering_functions import *
+from EDA_functions import *
+from database_functions import *
+from ingest_functions import *
+from benchmarks.data_generator import SCALES, workouts_csv, classes_csv
+
+BASELINES_PATH = './benchmarks/baselines.json'
+# a benchmark regresses when it gets this many times slower (or hungrier) than its baseline...
+REGRESSION_THRESHOLD = 1.25
+# ...by more than these absolute amounts, which keeps timer noise on the fastest benchmarks from failing the run:
+MIN_REGRESSION_SECONDS = 0.005
+MIN_REGRESSION_MB = 1
+
+
+# times func (best of repeat runs) and measures the peak memory it allocates with tracemalloc, in a separate run
+# since tracing slows everything down. setup runs before every run, untimed. tracemalloc sees the allocations of
+# python and numpy/pandas, but not those made inside pyarrow:
+def measure(func, repeat=3, setup=None):
+    seconds = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+
+    if setup is not None:
+        setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {'seconds': round(min(seconds), 5), 'peak_mb': round(peak / 1024 ** 2, 3)}
+
+
+# loads the data of a scale once and derives what the benchmarks take as input:
+class BenchmarkData:
+    def __init__(self, scale):
+        self.scale = scale
+        self.workouts_csv = workouts_csv(scale)
+        self.classes_csv = classes_csv(scale)
+        # the timestamps and titles as they are written in the export, for the functions that parse them:
+        self.export_strings = pd.read_csv(self.workouts_csv, usecols=['Workout Timestamp', 'Title'], dtype=str)
+        self.raw_workouts = read_workout_export(self.workouts_csv)
+        self.workouts = enrich_workouts(self.raw_workouts)
+        self.class_dir = tempfile.mkdtemp(prefix='class_data_')
+        self.store_dir = os.path.join(self.class_dir, 'master_classes/')
+        self.db_path = os.path.join(self.class_dir, 'classes.sqlite')
+        load_class_database(self)
+        # the instructor with the most rated classes, for the hero charts and queries:
+        with closing(read_class_database(self.db_path)) as conn:
+            self.hero = conn.execute('SELECT instructor_name FROM classes WHERE "overall rating count" != 0 '
+                                     'GROUP BY instructor_name ORDER BY COUNT(*) DESC LIMIT 1').fetchone()[0]
+        self.hero_classes = query_instructor_classes(self.hero, self.db_path)
+        self.dates = list(self.workouts['workout: datetime'])
+
+    def reset_class_store(self):
+        shutil.rmtree(self.class_dir, ignore_errors=True)
+
+    def close(self):
+        self.reset_class_store()
+
+
+# the load_class_database path of the dashboard: the class store built from the csv if needed, then the class database
+# brought up to date with it:
+def load_class_database(d):
+    ensure_class_store(d.classes_csv, d.store_dir)
+    return ensure_class_database(d.store_dir, d.db_path)
+
+
+HERO_HOVER_DATA = ['title', 'premiere', 'average difficulty rating', 'difficulty rating count',
+                   'overall rating average', 'overall rating count', 'total user workouts']
+
+# every benchmark: name -> (function of the BenchmarkData, untimed setup or None, largest scale it runs at or None).
+# the plotly express charts that ship every row to the browser are capped at 1m rows:
+BENCHMARKS = {
+    # ingest:
+    'read_workout_export': (lambda d: read_workout_export(d.workouts_csv), None, None),
+    # feature engineering:
+    'parse_timestamps': (lambda d: parse_timestamps(d.export_strings['Workout Timestamp']), None, None),
+    'day_of_week': (lambda d: day_of_week(d.export_strings, 'Workout Timestamp'), None, None),
+    'date_cleaner': (lambda d: date_cleaner(d.export_strings, 'Workout Timestamp', 16), None, None),
+    'time_of_day': (lambda d: time_of_day(d.export_strings, 'Workout Timestamp'), None, None),
+    'month_of_year': (lambda d: month_of_year(d.export_strings, 'Workout Timestamp'), None, None),
+    'get_workout_type': (lambda d: get_workout_type(d.export_strings), None, None),
+    'get_hero': (lambda d: get_hero(d.workouts, 'Calories Burned'), None, None),
+    'longest_streak': (lambda d: longest_streak(d.workouts, 'workout: datetime'), None, None),
+    'longest_streak2': (lambda d: longest_streak2(d.workouts, 'workout: datetime'), None, None),
+    'is_consecutive': (lambda d: [is_consecutive(a, b) for a, b in zip(d.dates, d.dates[1:])], None, None),
+    'get_total_workout_time': (lambda d: get_total_workout_time(d.workouts, 'Length (minutes)'), None, None),
+    'hardest_workout_metrics': (lambda d: hardest_workout_metrics(d.workouts, 'Calories Burned', 'Length (minutes)',
+                                                                  'Title'), None, None),
+    'period_ordinals': (lambda d: period_ordinals(d.workouts['workout: datetime'], 'W'), None, None),
+    'ordinal_dates': (lambda d: ordinal_dates(period_ordinals(d.workouts['workout: datetime'])), None, None),
+    'workout_streaks': (lambda d: workout_streaks(d.workouts, 'workout: datetime'), None, None),
+    'workout_streaks by discipline': (lambda d: workout_streaks(d.workouts, 'workout: datetime',
+                                                                by='Fitness Discipline'), None, None),
+    'streak_summary': (lambda d: streak_summary(d.workouts, 'workout: datetime', freq='W'), None, None),
+    'enrich_workouts': (lambda d: enrich_workouts(d.raw_workouts), None, None),
+    'workout_kpis': (lambda d: workout_kpis(d.workouts), None, None),
+    # charts:
+    'aggregate': (lambda d: aggregate(d.workouts, 'Instructor Name', 'Calories Burned', func='avg'), None, None),
+    'histogram': (lambda d: histogram(d.workouts, 'workout: title', 'Calories Burned', 'sum', 700, 600), None, None),
+    'count_histogram': (lambda d: count_histogram(d.workouts, 'workout: time of day', 'Type', 700, 600, TIMES_OF_DAY),
+                        None, None),
+    'scatter_matrix': (lambda d: scatter_matrix(d.workouts, 'Fitness Discipline', ['Calories Burned', 'Avg. Heartrate'],
+                                                700, 600), None, '1m'),
+    'strip_plot': (lambda d: strip_plot(d.workouts, 'Instructor Name', 'Calories Burned', 'Type', 700, 600),
+                   None, '1m'),
+    'day_of_week_heatmap': (lambda d: day_of_week_heatmap(d.workouts.copy(), 'Calories Burned', 700, 600),
+                            None, '1m'),
+    'heatmap': (lambda d: heatmap(d.workouts, 'Avg. Heartrate', 'Calories Burned', 700, 600), None, None),
+    'box_stats': (lambda d: box_stats(d.workouts['Calories Burned'].to_numpy(dtype=float)), None, None),
+    'marginal_subplots': (lambda d: marginal_subplots(), None, None),
+    'class_scatter': (lambda d: class_scatter(d.hero_classes, 'overall rating average',
+                                              'overall rating count', 'total user workouts', 'fitness discipline',
+                                              HERO_HOVER_DATA, 'ratings', np.arange(0, 101), 650, 600), None, None),
+    # class data (the class database and the instructor queries of the dashboard):
+    'load_class_database (cold)': (load_class_database, lambda d: d.reset_class_store(), None),
+    'load_class_database (warm)': (load_class_database, None, None),
+    'query_instructor_classes': (lambda d: query_instructor_classes(d.hero, d.db_path), None, None),
+    'query_instructor_kpis': (lambda d: query_instructor_kpis(d.hero, d.db_path), None, None),
+    'query_instructor_leaderboards': (lambda d: query_instructor_leaderboards(d.hero, db_path=d.db_path), None, None),
+}
+
+
+# runs the benchmarks (all, or those whose name contains one of only) at one scale. returns {name: measurement}:
+def run_benchmarks(scale, only=None, repeat=3):
+    data = BenchmarkData(scale)
+    results = {}
+    try:
+        for name, (func, setup, max_scale) in BENCHMARKS.items():
+            if only and not any(pattern in name for pattern in only):
+                continue
+            if max_scale is not None and SCALES[scale] > SCALES[max_scale]:
+                continue
+            results[name] = measure(lambda: func(data), repeat,
+                                    setup=None if setup is None else (lambda: setup(data)))
+    finally:
+        data.close()
+
+    return results
+
+
+def read_baselines(path=BASELINES_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+# merges the results of every scale into the stored baselines:
+def write_baselines(results, path=BASELINES_PATH):
+    baselines = read_baselines(path)
+    for scale, scale_results in results.items():
+        baselines.setdefault(scale, {}).update(scale_results)
+    with open(path, 'w') as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+# compares results against the baselines. returns a list of (scale, name, metric, baseline, result) regressions:
+def find_regressions(results, baselines, threshold=REGRESSION_THRESHOLD):
+    regressions = []
+    for scale, scale_results in results.items():
+        for name, result in scale_results.items():
+            baseline = baselines.get(scale, {}).get(name)
+            if baseline is None:
+                continue
+            for metric, min_regression in (('seconds', MIN_REGRESSION_SECONDS), ('peak_mb', MIN_REGRESSION_MB)):
+                if (result[metric] > baseline[metric] * threshold and
+                        result[metric] - baseline[metric] > min_regression):
+                    regressions.append((scale, name, metric, baseline[metric], result[metric]))
+
+    return regressions
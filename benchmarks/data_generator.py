@@ -0,0 +1,145 @@
+import os
+import numpy as np
+import pandas as pd
+
+# synthetic data shaped like the peloton workout export (data/my_workouts.csv) and the class archive
+# (data/class_data/master_classes.csv), for benchmarking at any scale. rows are generated and written in chunks, so that
+# even the largest scales never hold more than a chunk in memory:
+
+# named scales (rows) used by the benchmarks:
+SCALES = {'1k': 1000, '10k': 10000, '100k': 100000, '1m': 1000000, '10m': 10000000}
+GENERATOR_CHUNK_SIZE = 1000000
+GENERATED_DATA_DIR = './benchmarks/data/'
+
+INSTRUCTORS = ['Aditi Shah', 'Adrian Williams', 'Alex Toussaint', 'Ally Love', 'Andy Speer', 'Anna Greenberg',
+               'Becs Gentry', 'Ben Alldis', 'Bradley Rose', 'Callie Gullickson', 'Camila Ramon', 'Chase Tucker',
+               'Christine D\'Ercole', 'Cliff Dwenger', 'Cody Rigsby', 'Denis Morton', 'Emma Lovewell', 'Erik Jager',
+               'Hannah Corbin', 'Hannah Frankson', 'Jenn Sherman', 'Jess King', 'Jess Sims', 'Kendall Toole',
+               'Leanne Hainsby', 'Matt Wilpers', 'Olivia Amato', 'Robin Arzon', 'Sam Yo', 'Tunde Oyeneyin']
+DISCIPLINES = {'cycling': 'Cycling', 'strength': 'Strength', 'running': 'Running', 'yoga': 'Yoga',
+               'stretching': 'Stretching', 'meditation': 'Meditation', 'walking': 'Walking', 'cardio': 'Cardio'}
+# relative frequency of every discipline in the workout export:
+DISCIPLINE_WEIGHTS = [0.6, 0.15, 0.05, 0.05, 0.08, 0.03, 0.02, 0.02]
+WORKOUT_TYPES = ['Music', 'Theme', 'Intervals', 'Climb', 'Low Impact', 'Beginner', 'Power Zone', 'Tabata', 'HIIT',
+                 'Live DJ']
+LENGTHS = [5, 10, 15, 20, 30, 45, 60, 75, 90]
+LENGTH_WEIGHTS = [0.05, 0.1, 0.1, 0.15, 0.35, 0.15, 0.06, 0.02, 0.02]
+UTC_OFFSETS = [' (-04)', ' (-05)']
+# first workout/class of the generated data, and the number of minutes the data spans at most. rows are spread out
+# (up to one workout every 20 hours, one class every 30 minutes) until the largest scales need to pack them closer:
+START_DATE = np.datetime64('2016-01-01T05:00')
+MAX_SPAN_MINUTES = 60 * 24 * 365 * 6
+WORKOUT_MINUTES_APART = 60 * 20
+CLASS_MINUTES_APART = 30
+
+
+# formats minute precision datetimes like the export ('2021-10-17 12:11'):
+def _format_minutes(timestamps):
+    return pd.Series(np.datetime_as_string(timestamps, unit='m')).str.replace('T', ' ', regex=False)
+
+
+# chronologically sorted minute timestamps, on average one every minutes_apart minutes:
+def _timestamps(rng, n, start, minutes_apart):
+    offsets = np.cumsum(rng.exponential(minutes_apart, n)).astype('int64')
+    return start + offsets.astype('timedelta64[m]')
+
+
+# returns n rows of a workouts export as the strings peloton writes (percentages, utc offsets, blanks):
+def generate_workouts(n, seed=0, start=START_DATE, minutes_apart=WORKOUT_MINUTES_APART):
+    rng = np.random.default_rng(seed)
+    workout_times = _timestamps(rng, n, start, minutes_apart)
+    class_times = workout_times - (rng.exponential(60 * 24 * 20, n).astype('int64')).astype('timedelta64[m]')
+    offsets = np.array(UTC_OFFSETS)[(rng.random(n) < 0.6).astype(int)]
+    lengths = rng.choice(LENGTHS, n, p=LENGTH_WEIGHTS)
+    types = rng.choice(WORKOUT_TYPES, n)
+    disciplines = rng.choice(list(DISCIPLINES.values()), n, p=DISCIPLINE_WEIGHTS)
+    cycling = disciplines == 'Cycling'
+
+    watts = rng.normal(116, 13, n).clip(20).round()
+    workouts_df = pd.DataFrame({
+        'Workout Timestamp': _format_minutes(workout_times) + offsets,
+        'Live/On-Demand': np.where(rng.random(n) < 0.1, 'Live', 'On Demand'),
+        'Instructor Name': rng.choice(INSTRUCTORS, n),
+        'Length (minutes)': lengths,
+        'Fitness Discipline': disciplines,
+        'Type': types,
+        'Title': pd.Series(lengths).astype(str) + ' min ' + pd.Series(types) + ' Ride',
+        'Class Timestamp': _format_minutes(class_times) + offsets,
+        'Total Output': np.where(cycling, (watts * lengths * 60 / 1000).round(), np.nan),
+        'Avg. Watts': np.where(cycling, watts, np.nan),
+        'Avg. Resistance': pd.Series(rng.integers(30, 55, n).astype(str)).add('%').where(cycling),
+        'Avg. Cadence (RPM)': np.where(cycling, rng.normal(78, 3, n).round(), np.nan),
+        'Avg. Speed (mph)': np.where(cycling, rng.normal(16.8, 0.8, n).round(2), np.nan),
+        'Distance (mi)': np.where(cycling, (rng.normal(16.8, 0.8, n) * lengths / 60).round(2), np.nan),
+        'Calories Burned': (rng.normal(13, 3, n).clip(1) * lengths).round(),
+        'Avg. Heartrate': rng.normal(145, 14, n).round(2),
+        'Avg. Incline': np.nan,
+        'Avg. Pace (min/mi)': np.nan})
+
+    return workouts_df
+
+
+# returns n classes shaped like the rows of the class archive (in order of air time):
+def generate_classes(n, seed=0, start=START_DATE, minutes_apart=CLASS_MINUTES_APART):
+    rng = np.random.default_rng(seed)
+    air_times = _format_minutes(_timestamps(rng, n, start, minutes_apart))
+    disciplines = rng.choice(list(DISCIPLINES), n)
+    instructor_codes = rng.integers(0, len(INSTRUCTORS), n)
+    ids = pd.Series(rng.integers(0, 2 ** 63, n, dtype='int64')).map('{:016x}'.format)
+    lengths = rng.choice(LENGTHS, n, p=LENGTH_WEIGHTS)
+    types = rng.choice(WORKOUT_TYPES, n)
+    titles = pd.Series(lengths).astype(str) + ' min ' + pd.Series(types) + ' Ride'
+    rating_counts = rng.zipf(1.6, n).clip(0, 100000) - 1
+
+    classes_df = pd.DataFrame({
+        'id': ids + ids.str[::-1],
+        'title': titles,
+        'image_url': 'https://s3.amazonaws.com/peloton-ride-images/' + ids + '.png',
+        'instructor_id': pd.Series(instructor_codes).map('{:032x}'.format),
+        'instructor_name': np.array(INSTRUCTORS)[instructor_codes],
+        'fitness_discipline': disciplines,
+        'fitness_discipline_display_name': pd.Series(disciplines).map(DISCIPLINES),
+        'duration': lengths * 60,
+        'difficulty_rating_avg': rng.uniform(3, 9, n),
+        'difficulty_rating_count': (rating_counts * rng.uniform(0.2, 0.6, n)).astype('int64'),
+        'overall_rating_avg': rng.beta(30, 1, n),
+        'overall_rating_count': rating_counts,
+        'total_workouts': rating_counts * rng.integers(1, 4, n),
+        'original_air_time': air_times,
+        'original_airtime': air_times,
+        'workout: title': titles})
+
+    return classes_df
+
+
+# writes n generated rows to a csv chunk by chunk. every chunk is seeded from seed and its position, and continues the
+# timeline (time_col) where the previous chunk left off:
+def write_generated_csv(generate, path, n, time_col, minutes_apart, seed=0, chunk_size=GENERATOR_CHUNK_SIZE):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    start = START_DATE
+    minutes_apart = min(minutes_apart, MAX_SPAN_MINUTES / n)
+    with open(path, 'w', newline='') as f:
+        for i, chunk_start in enumerate(range(0, n, chunk_size)):
+            chunk_df = generate(min(chunk_size, n - chunk_start), seed=(seed, i), start=start,
+                                minutes_apart=minutes_apart)
+            chunk_df.to_csv(f, header=(i == 0), index=False)
+            start = np.datetime64(chunk_df[time_col].iloc[-1][:16])
+    return path
+
+
+# returns the path of the generated workouts export of the given scale, generating it on first use:
+def workouts_csv(scale, data_dir=GENERATED_DATA_DIR, seed=0):
+    path = os.path.join(data_dir, 'workouts_' + scale + '.csv')
+    if not os.path.exists(path):
+        write_generated_csv(generate_workouts, path, SCALES[scale], 'Workout Timestamp', WORKOUT_MINUTES_APART,
+                            seed)
+    return path
+
+
+# returns the path of the generated class archive of the given scale, generating it on first use:
+def classes_csv(scale, data_dir=GENERATED_DATA_DIR, seed=0):
+    path = os.path.join(data_dir, 'master_classes_' + scale + '.csv')
+    if not os.path.exists(path):
+        write_generated_csv(generate_classes, path, SCALES[scale], 'original_air_time', CLASS_MINUTES_APART,
+                            seed)
+    return path
@@ -0,0 +1,276 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from benchmarks.data_generator import INSTRUCTORS, DISCIPLINES, WORKOUT_TYPES, LENGTHS
+
+# local stand-in for api.onepeloton.com, serving synthetic data from the endpoints used by api_functions.py, with
+# configurable latency, jitter, server errors and rate limiting (429s). point the client at it with:
+#   PELOTON_API_URL=http://127.0.0.1:8765 python ...
+# or run it on its own with:
+#   python -m benchmarks.mock_peloton_api --port 8765 --latency 50 --jitter 20 --error-rate 0.01
+
+# newest class/workout of the synthetic data (unix time):
+MOCK_NOW = 1640995200
+# instructors whose workouts are not public, and instructors that are only reachable through instructor/{id}:
+PRIVATE_INSTRUCTORS = 5
+UNLISTED_INSTRUCTORS = 3
+
+
+def _hex_id(rng):
+    return '{:032x}'.format(int(rng.integers(0, 2 ** 63)) << 64 | int(rng.integers(0, 2 ** 63)))
+
+
+# the synthetic classes, instructors and instructor taken workouts served by the mock api, all newest first:
+class MockPelotonData:
+    def __init__(self, n_classes=10000, workouts_per_instructor=500, seed=0):
+        rng = np.random.default_rng(seed)
+        names = INSTRUCTORS + ['Guest Instructor ' + str(i) for i in range(UNLISTED_INSTRUCTORS)]
+        self.instructors = [{'id': _hex_id(rng), 'user_id': _hex_id(rng), 'name': name,
+                             'quote': '“Quote of ' + name + '”',
+                             'about_image_url': 'https://s3.amazonaws.com/workout-metric-images-prod/' + str(i) + '.png'}
+                            for i, name in enumerate(names)]
+        self.listed_instructors = self.instructors[:len(INSTRUCTORS)]
+        self.instructors_by_id = {instructor['id']: instructor for instructor in self.instructors}
+        self.private_user_ids = {instructor['user_id'] for instructor in self.listed_instructors[:PRIVATE_INSTRUCTORS]}
+
+        disciplines = list(DISCIPLINES)
+        self.classes = []
+        air_time = MOCK_NOW
+        for _ in range(n_classes):
+            air_time -= int(rng.integers(60, 3600))
+            discipline = disciplines[rng.integers(len(disciplines))]
+            length = int(LENGTHS[rng.integers(len(LENGTHS))])
+            rating_count = int(rng.zipf(1.6)) - 1
+            self.classes.append({
+                'id': _hex_id(rng),
+                'title': str(length) + ' min ' + WORKOUT_TYPES[rng.integers(len(WORKOUT_TYPES))] + ' Ride',
+                'image_url': 'https://s3.amazonaws.com/peloton-ride-images/' + str(len(self.classes)) + '.png',
+                'instructor_id': self.instructors[rng.integers(len(self.instructors))]['id'],
+                'fitness_discipline': discipline,
+                'fitness_discipline_display_name': DISCIPLINES[discipline],
+                'duration': length * 60,
+                'difficulty_rating_avg': float(rng.uniform(3, 9)),
+                'difficulty_rating_count': rating_count // 3,
+                'overall_rating_avg': float(rng.beta(30, 1)),
+                'overall_rating_count': rating_count,
+                'total_workouts': rating_count * 2,
+                'original_air_time': air_time})
+        self.classes_by_slug = {slug: [c for c in self.classes if c['fitness_discipline'] == slug]
+                                for slug in disciplines}
+
+        self.workouts = {}
+        self.user_workouts = {}
+        for instructor in self.listed_instructors:
+            created_at = MOCK_NOW
+            user_workouts = []
+            for _ in range(workouts_per_instructor):
+                created_at -= int(rng.integers(3600, 3 * 24 * 3600))
+                ride = self.classes[rng.integers(len(self.classes))] if self.classes else None
+                workout = {'id': _hex_id(rng), 'created_at': created_at, 'status': 'COMPLETE',
+                           'fitness_discipline': ride['fitness_discipline'] if ride else 'meditation',
+                           'name': ride['title'] if ride else 'Just Ride', 'workout_type': 'class',
+                           'ride': {'id': ride['id'], 'instructor_id': ride['instructor_id']} if ride else None}
+                self.workouts[workout['id']] = workout
+                user_workouts.append({key: workout[key] for key in ('id', 'created_at', 'status',
+                                                                    'fitness_discipline', 'name')})
+            self.user_workouts[instructor['user_id']] = user_workouts
+
+
+# returns one page of records in the api's paginated shape:
+def paginate(records, query, default_limit=18):
+    limit = int(query.get('limit', [default_limit])[0] or default_limit)
+    page = int(query.get('page', [0])[0] or 0)
+    page_count = (len(records) + limit - 1) // limit
+    return {'data': records[page * limit:(page + 1) * limit], 'page': page, 'page_count': page_count,
+            'limit': limit, 'total': len(records), 'show_next': page < page_count - 1}
+
+
+class MockPelotonHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=None, headers=None):
+        payload = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+        self.server.count(self.path, status, len(payload))
+
+    # sleeps for the configured latency, then maybe fails the request. returns True when a failure was sent:
+    def _inject_faults(self):
+        server = self.server
+        delay = server.latency + random.uniform(-server.jitter, server.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        roll = random.random()
+        if roll < server.rate_limit_rate:
+            self._send(429, {'status': 429, 'message': 'Too Many Requests'},
+                       {'Retry-After': str(server.retry_after)})
+            return True
+        if roll < server.rate_limit_rate + server.error_rate:
+            self._send(503, {'status': 503, 'message': 'Service Unavailable'})
+            return True
+        return False
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if urlsplit(self.path).path != '/auth/login':
+            return self._send(404, {'status': 404})
+        session_id = self.server.new_session()
+        self._send(200, {'user_id': 'mock-user', 'session_id': session_id},
+                   {'Set-Cookie': 'peloton_session_id=' + session_id + '; Path=/'})
+
+    def _authorized(self):
+        cookies = dict(cookie.strip().split('=', 1) for cookie in self.headers.get('Cookie', '').split(';')
+                       if '=' in cookie)
+        return self.server.valid_session(cookies.get('peloton_session_id'))
+
+    def do_GET(self):
+        if self._inject_faults():
+            return
+        if self.server.require_auth and not self._authorized():
+            return self._send(401, {'status': 401, 'message': 'Login required'})
+        data = self.server.data
+        url = urlsplit(self.path)
+        query = parse_qs(url.query, keep_blank_values=True)
+
+        if url.path == '/api/v2/ride/archived':
+            slug = query.get('browse_category', [''])[0]
+            page = paginate(data.classes_by_slug.get(slug, []) if slug else data.classes, query)
+            page['browse_categories'] = [{'slug': slug, 'name': name} for slug, name in DISCIPLINES.items()]
+            return self._send(200, page)
+        if url.path == '/api/instructor':
+            return self._send(200, paginate(data.listed_instructors, query, default_limit=100))
+        if url.path == '/api/ride/metadata_mappings':
+            return self._send(200, {'device_type_display_names': [{'device_type': 'home_bike_v1',
+                                                                   'display_name': 'Bike'}]})
+
+        match = re.fullmatch(r'/api/instructor/([^/]+)', url.path)
+        if match:
+            instructor = data.instructors_by_id.get(match.group(1))
+            return self._send(200, instructor) if instructor else self._send(404, {'status': 404})
+        match = re.fullmatch(r'/api/user/([^/]+)/workouts', url.path)
+        if match:
+            if match.group(1) in data.private_user_ids:
+                return self._send(403, {'status': 403, 'error_code': 3030, 'message': 'This user is private'})
+            return self._send(200, paginate(data.user_workouts.get(match.group(1), []), query))
+        match = re.fullmatch(r'/api/workout/([^/]+)', url.path)
+        if match:
+            workout = data.workouts.get(match.group(1))
+            if workout is None:
+                return self._send(404, {'status': 404})
+            etag = '"' + workout['id'] + '"'
+            if self.headers.get('If-None-Match') == etag:
+                return self._send(304, headers={'ETag': etag})
+            return self._send(200, workout, {'ETag': etag})
+
+        self._send(404, {'status': 404})
+
+
+# the mock api server. latency and jitter are in seconds, error_rate and rate_limit_rate are the shares of GET
+# requests answered with a 503 and a 429 (with a Retry-After of retry_after seconds). with require_auth, GETs without
+# the session cookie of a login get a 401:
+class MockPelotonServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, data=None, host='127.0.0.1', port=0, latency=0, jitter=0, error_rate=0, rate_limit_rate=0,
+                 retry_after=0, require_auth=False):
+        super().__init__((host, port), MockPelotonHandler)
+        self.data = data or MockPelotonData()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.require_auth = require_auth
+        self._lock = threading.Lock()
+        self.sessions = set()
+        self.logins = 0
+        self.reset_stats()
+
+    def new_session(self):
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            self.sessions.add(session_id)
+            self.logins += 1
+        return session_id
+
+    def valid_session(self, session_id):
+        with self._lock:
+            return session_id in self.sessions
+
+    # expires every session, as if they all timed out:
+    def expire_sessions(self):
+        with self._lock:
+            self.sessions.clear()
+
+    @property
+    def url(self):
+        return 'http://' + self.server_address[0] + ':' + str(self.server_address[1])
+
+    def reset_stats(self):
+        with self._lock:
+            self.requests = 0
+            self.bytes_sent = 0
+            self.statuses = {}
+
+    def count(self, path, status, size):
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += size
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            return {'requests': self.requests, 'bytes': self.bytes_sent, 'statuses': dict(self.statuses)}
+
+    # serves requests from a background thread:
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serves a mock Peloton API with synthetic data.')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--classes', type=int, default=10000)
+    parser.add_argument('--workouts-per-instructor', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0, help='milliseconds')
+    parser.add_argument('--jitter', type=float, default=0, help='milliseconds')
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0)
+    parser.add_argument('--retry-after', type=int, default=1, help='seconds')
+    parser.add_argument('--require-auth', action='store_true')
+    args = parser.parse_args(argv)
+
+    server = MockPelotonServer(MockPelotonData(args.classes, args.workouts_per_instructor), port=args.port,
+                               latency=args.latency / 1000, jitter=args.jitter / 1000, error_rate=args.error_rate,
+                               rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after,
+                               require_auth=args.require_auth)
+    print('serving the mock Peloton API on ' + server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+import argparse
+import sys
+from benchmarks.benchmark_functions import *
+
+# runs the benchmarks from the repo root, i.e.:
+#   python -m benchmarks.run_benchmarks --scales 1k 10k 100k
+#   python -m benchmarks.run_benchmarks --scales 1m --only streak kpis
+#   python -m benchmarks.run_benchmarks --scales 1k 10k 100k --update-baselines
+# and exits with status 1 when any benchmark regressed against the stored baselines.
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Times the dashboard functions on generated data.')
+    parser.add_argument('--scales', nargs='+', default=['1k', '10k', '100k'], choices=list(SCALES))
+    parser.add_argument('--only', nargs='+', help='run the benchmarks whose name contains any of these')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument('--update-baselines', action='store_true')
+    args = parser.parse_args(argv)
+
+    baselines = read_baselines()
+    results = {}
+    for scale in args.scales:
+        results[scale] = run_benchmarks(scale, args.only, args.repeat)
+        print('\n' + scale + ' rows:')
+        print('{:<36}{:>12}{:>12}{:>12}{:>12}'.format('benchmark', 'seconds', 'baseline', 'peak MB', 'baseline'))
+        for name, result in results[scale].items():
+            baseline = baselines.get(scale, {}).get(name, {})
+            print('{:<36}{:>12.4f}{:>12}{:>12.2f}{:>12}'.format(
+                name, result['seconds'], '{:.4f}'.format(baseline['seconds']) if baseline else '-',
+                result['peak_mb'], '{:.2f}'.format(baseline['peak_mb']) if baseline else '-'))
+
+    if args.update_baselines:
+        write_baselines(results)
+        print('\nbaselines updated.')
+        return 0
+
+    regressions = find_regressions(results, baselines, args.threshold)
+    for scale, name, metric, baseline, result in regressions:
+        print('REGRESSION {} {} {}: {} -> {}'.format(scale, name, metric, baseline, result))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
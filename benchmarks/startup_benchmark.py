@@ -0,0 +1,71 @@
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# measures cold start: the time a fresh python process takes to import each module (and the dashboard to get through
+# its imports), against a target per module. the api is pointed at a closed port, so any network use at import time
+# fails the benchmark:
+#   python -m benchmarks.startup_benchmark
+
+# targets (seconds), measured on a warm disk cache:
+STARTUP_TARGETS = {'api_functions': 1.0,
+                   'feature_engineering_functions': 1.0,
+                   'class_data_functions': 1.0,
+                   'ingest_functions': 1.0,
+                   'EDA_functions': 1.0,
+                   'peloton_dash imports': 2.5}
+# nothing listens on the discard port:
+OFFLINE_API_URL = 'http://127.0.0.1:9'
+
+
+# the import statements of the dashboard script:
+def dashboard_imports(path='peloton_dash.py'):
+    with open(path) as f:
+        return ''.join(line for line in f if re.match(r'(import|from) \S+', line))
+
+
+# times one fresh interpreter running code, returning the wall-clock seconds measured inside it:
+def time_cold_import(code, env):
+    timed = ('import time\n_start = time.perf_counter()\n' + code +
+             '\nprint("startup secs", time.perf_counter() - _start)\n')
+    result = subprocess.run([sys.executable, '-c', timed], env=env, capture_output=True, text=True, timeout=120)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'import failed')
+    return float(re.search(r'startup secs (\S+)', result.stdout).group(1))
+
+
+# returns {name: median seconds over repeat cold starts}:
+def run_startup_benchmark(repeat=5):
+    env = dict(os.environ, PELOTON_API_URL=OFFLINE_API_URL,
+               PELOTON_SESSION_PATH=os.path.join(tempfile.mkdtemp(), 'session.json'))
+    env.pop('PELOTON_INSTRUMENTATION', None)
+    programs = {name: 'import ' + name for name in STARTUP_TARGETS if name != 'peloton_dash imports'}
+    programs['peloton_dash imports'] = dashboard_imports()
+
+    return {name: statistics.median(time_cold_import(code, env) for _ in range(repeat))
+            for name, code in programs.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Times the cold start imports of the modules.')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    results = run_startup_benchmark(args.repeat)
+    slow = []
+    print('{:<32}{:>10}{:>10}'.format('module', 'secs', 'target'))
+    for name, seconds in results.items():
+        print('{:<32}{:>10.3f}{:>10.2f}'.format(name, seconds, STARTUP_TARGETS[name]))
+        if seconds > STARTUP_TARGETS[name]:
+            slow.append(name)
+    if slow:
+        print('over target: ' + ', '.join(slow))
+    return 1 if slow else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+import argparse
+import contextlib
+import importlib
+import io
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import pandas as pd
+from benchmarks.mock_peloton_api import MockPelotonData, MockPelotonServer
+
+# benchmarks the syncs of api_functions.py (get_class_diff and update_instructor_workouts) end to end against the
+# mock api, i.e.:
+#   python -m benchmarks.sync_benchmark --workers 1 8 16 --latency 50 --jitter 20 --rate-limit-rate 0.01
+# every run starts from local data that is missing the newest classes and workouts, and reports how long each sync
+# took to catch up, how many requests it made and whether it ended up with every record.
+
+
+# imports api_functions against the mock server, without the response cache or a saved session:
+def import_api_functions(api_url):
+    os.environ['PELOTON_API_URL'] = api_url
+    api_functions = importlib.import_module('api_functions')
+    api_functions.API_URL = api_url
+    api_functions.SESSION_PATH = ''
+    api_functions.CACHE_PATH = None
+    return api_functions
+
+
+# writes the local data the syncs start from (everything but the newest new_classes classes and new_workouts
+# workouts of every instructor) to work_dir, and points api_functions at it:
+def seed_local_data(api_functions, data, work_dir, new_classes, new_workouts):
+    api_functions.INSTRUCTORS_CSV = os.path.join(work_dir, 'complete_instructors_list.csv')
+    pd.DataFrame(data.listed_instructors).to_csv(api_functions.INSTRUCTORS_CSV, index=None)
+
+    api_functions.CURSOR_DIR = os.path.join(work_dir, 'cursors/')
+    api_functions.CLASS_DATABASE = os.path.join(work_dir, 'classes.sqlite')
+    store_dir = os.path.join(work_dir, 'master_classes/')
+    old_classes_df = api_functions.preprocess_classes_data(pd.DataFrame(data.classes[new_classes:]))
+    api_functions.write_class_store(api_functions.prepare_class_frame(old_classes_df), store_dir)
+
+    api_functions.INSTRUCTOR_WORKOUTS_DIR = os.path.join(work_dir, 'instructor_workouts/')
+    os.makedirs(api_functions.INSTRUCTOR_WORKOUTS_DIR)
+    for instructor in data.listed_instructors:
+        workouts_df = pd.DataFrame(data.user_workouts[instructor['user_id']][new_workouts:])
+        workouts_df.to_csv(api_functions.INSTRUCTOR_WORKOUTS_DIR + instructor['name'].replace(' ', '_') + '.csv',
+                           index=None)
+    return store_dir
+
+
+# counts the workouts saved for every instructor:
+def count_instructor_workouts(workouts_dir):
+    return sum(len(pd.read_csv(os.path.join(workouts_dir, name), usecols=['id'])) for name in os.listdir(workouts_dir))
+
+
+# runs both syncs once per number of workers and returns a row of results for each:
+def run_sync_benchmark(server, workers_list, new_classes, new_workouts, processes=1):
+    api_functions = import_api_functions(server.url)
+    data = server.data
+    expected_workouts = sum(len(data.user_workouts[instructor['user_id']]) for instructor in data.listed_instructors
+                            if instructor['user_id'] not in data.private_user_ids)
+
+    results = []
+    for workers in workers_list:
+        work_dir = tempfile.mkdtemp(prefix='sync_benchmark_')
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                store_dir = seed_local_data(api_functions, data, work_dir, new_classes, new_workouts)
+
+                server.reset_stats()
+                start = time.perf_counter()
+                api_functions.get_class_diff(workers, store_dir)
+                class_seconds = time.perf_counter() - start
+                class_stats = server.stats()
+
+                server.reset_stats()
+                start = time.perf_counter()
+                api_functions.update_instructor_workouts(workers, processes)
+                workout_seconds = time.perf_counter() - start
+                workout_stats = server.stats()
+
+            with sqlite3.connect(api_functions.CLASS_DATABASE) as conn:
+                database_classes = conn.execute('SELECT COUNT(*) FROM classes').fetchone()[0]
+            classes_synced = len(api_functions.read_class_ids(store_dir)) == database_classes == len(data.classes)
+            workouts_synced = count_instructor_workouts(api_functions.INSTRUCTOR_WORKOUTS_DIR) >= expected_workouts
+            results.append({'workers': workers,
+                            'processes': processes,
+                            'get_class_diff secs': round(class_seconds, 3),
+                            'get_class_diff requests': class_stats['requests'],
+                            'get_class_diff 429/5xx': sum(count for status, count in class_stats['statuses'].items()
+                                                         if status == 429 or status >= 500),
+                            'classes synced': classes_synced,
+                            'update_instructor_workouts secs': round(workout_seconds, 3),
+                            'update_instructor_workouts requests': workout_stats['requests'],
+                            'update_instructor_workouts 429/5xx': sum(
+                                count for status, count in workout_stats['statuses'].items()
+                                if status == 429 or status >= 500),
+                            'workouts synced': workouts_synced})
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return pd.DataFrame(results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks the api syncs against the mock Peloton API.')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8, 16])
+    parser.add_argument('--processes', type=int, default=1,
+                        help='number of processes update_instructor_workouts is sharded across')
+    parser.add_argument('--classes', type=int, default=20000)
+    parser.add_argument('--new-classes', type=int, default=2000)
+    parser.add_argument('--workouts-per-instructor', type=int, default=300)
+    parser.add_argument('--new-workouts', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=50, help='milliseconds')
+    parser.add_argument('--jitter', type=float, default=20, help='milliseconds')
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0)
+    parser.add_argument('--retry-after', type=int, default=1, help='seconds')
+    args = parser.parse_args(argv)
+
+    server = MockPelotonServer(MockPelotonData(args.classes, args.workouts_per_instructor),
+                               latency=args.latency / 1000, jitter=args.jitter / 1000, error_rate=args.error_rate,
+                               rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after).start()
+    try:
+        results = run_sync_benchmark(server, args.workers, args.new_classes, args.new_workouts, args.processes)
+    finally:
+        server.stop()
+
+    print(results.T.to_string(header=False))
+    return 0 if results['classes synced'].all() and results['workouts synced'].all() else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,178 @@
+from collections import OrderedDict
+import sqlite3
+import threading
+import time
+
+# the last use of an entry (which orders the evictions) is only written when the previous one is older than this, so
+# that a hit is a read instead of a write transaction:
+ACCESS_RESOLUTION_SECS = 60
+
+
+# persistent cache of API responses, stored in a sqlite file so that it is shared across script runs and streamlit
+# processes. entries expire after a per-entry ttl (None = never), keep their ETag/Last-Modified headers for
+# revalidation, and the least recently used entries are evicted once the cache grows past max_bytes:
+class ResponseCache:
+    def __init__(self, path, max_bytes=256 * 1024 ** 2):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS responses ('
+                           'url TEXT PRIMARY KEY, body BLOB, etag TEXT, last_modified TEXT, '
+                           'expires_at REAL, accessed_at REAL, size INTEGER)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)')
+        self._conn.commit()
+        # running total of the size of the entries, so that stores don't have to add them all up:
+        self._size = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    # returns the cached entry for url (or None), flagging whether it is still fresh:
+    def lookup(self, url):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT body, etag, last_modified, expires_at, accessed_at FROM responses '
+                                     'WHERE url = ?', (url,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            body, etag, last_modified, expires_at, accessed_at = row
+            fresh = expires_at is None or expires_at > now
+            if fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+            if accessed_at is None or now - accessed_at > ACCESS_RESOLUTION_SECS:
+                self._conn.execute('UPDATE responses SET accessed_at = ? WHERE url = ?', (now, url))
+                self._conn.commit()
+
+        return {'body': body, 'etag': etag, 'last_modified': last_modified, 'fresh': fresh}
+
+    # returns the conditional request headers for a stale entry:
+    @staticmethod
+    def validators(entry):
+        headers = {}
+        if entry is not None and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry is not None and entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    # saves a response body and its validators, then evicts the least recently used entries over the size limit:
+    def store(self, url, body, headers, ttl):
+        now = time.time()
+        expires_at = None if ttl is None else now + ttl
+        with self._lock:
+            replaced = self._conn.execute('SELECT size FROM responses WHERE url = ?', (url,)).fetchone()
+            self._conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                               (url, body, headers.get('ETag'), headers.get('Last-Modified'), expires_at, now,
+                                len(body)))
+            self._size += len(body) - (replaced[0] if replaced else 0)
+            if self._size > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    # extends the life of an entry the server confirmed unchanged (304):
+    def refresh(self, url, ttl):
+        now = time.time()
+        expires_at = None if ttl is None else now + ttl
+        with self._lock:
+            self.revalidations += 1
+            self._conn.execute('UPDATE responses SET expires_at = ?, accessed_at = ? WHERE url = ?',
+                               (expires_at, now, url))
+            self._conn.commit()
+
+    # the running total only counts this process's stores, so the total is recounted (other processes share the file)
+    # before evicting anything:
+    def _evict(self):
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total > self.max_bytes:
+            for url, size in self._conn.execute('SELECT url, size FROM responses ORDER BY accessed_at').fetchall():
+                self._conn.execute('DELETE FROM responses WHERE url = ?', (url,))
+                self.evictions += 1
+                total -= size
+                if total <= self.max_bytes:
+                    break
+        self._size = total
+
+    # hit/miss counters plus the current size of the cache:
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+            lookups = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit rate': round(self.hits / lookups, 3) if lookups else 0,
+                    'revalidations': self.revalidations,
+                    'evictions': self.evictions,
+                    'entries': entries,
+                    'bytes': size}
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM responses')
+            self._conn.commit()
+            self._size = 0
+
+
+# in-memory cache of finished plotly figures, stored as their json so that a rerun of the dashboard with the same data
+# and widget state skips building the figure. keyed on (dataset fingerprint, chart id, selected options), and bounded
+# by both the number of entries and their total size, evicting the least recently used figures first:
+class FigureCache:
+    def __init__(self, max_entries=128, max_bytes=64 * 1024 ** 2):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        self._lock = threading.Lock()
+        self._figures = OrderedDict()
+
+    # returns the cached figure for key, calling build() to make (and cache) it on a miss:
+    def get_or_build(self, key, build):
+        import plotly.io as pio
+
+        with self._lock:
+            fig_json = self._figures.get(key)
+            if fig_json is not None:
+                self._figures.move_to_end(key)
+                self.hits += 1
+        if fig_json is not None:
+            return pio.from_json(fig_json)
+
+        fig = build()
+        fig_json = fig.to_json()
+        with self._lock:
+            self.misses += 1
+            if key not in self._figures:
+                self._figures[key] = fig_json
+                self.size += len(fig_json)
+                self._evict()
+        return fig
+
+    def _evict(self):
+        while self._figures and (len(self._figures) > self.max_entries or self.size > self.max_bytes):
+            _, fig_json = self._figures.popitem(last=False)
+            self.size -= len(fig_json)
+            self.evictions += 1
+
+    # hit/miss counters plus the current size of the cache:
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit rate': round(self.hits / lookups, 3) if lookups else 0,
+                    'evictions': self.evictions,
+                    'entries': len(self._figures),
+                    'bytes': self.size}
+
+    def clear(self):
+        with self._lock:
+            self._figures.clear()
+            self.size = 0
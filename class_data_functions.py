@@ -0,0 +1,330 @@
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+import pandas as pd
+from humanfriendly import format_timespan
+
+# master file with every class, and the columnar (parquet) store built from it:
+CLASS_DATA_DIR = './data/class_data/'
+MASTER_CLASSES_CSV = CLASS_DATA_DIR + 'master_classes.csv'
+CLASS_STORE_DIR = CLASS_DATA_DIR + 'master_classes/'
+# the store's base is partitioned into one directory per fitness discipline:
+CLASS_STORE_PARTITION = 'fitness_discipline'
+# number of delta segments appended by the syncs before they get compacted into the base:
+COMPACT_AFTER_SEGMENTS = 30
+
+# raw class columns renamed for the dashboard:
+CLASS_COLUMN_NAMES = {'difficulty_rating_avg': 'average difficulty rating',
+                      'fitness_discipline_display_name': 'fitness discipline',
+                      'difficulty_rating_count': 'difficulty rating count',
+                      'original_air_time': 'premiere',
+                      'overall_rating_avg': 'overall rating average',
+                      'overall_rating_count': 'overall rating count',
+                      'total_workouts': 'total user workouts'}
+
+# the current dataset version, published by the sync (sync_functions.py) and read by the dashboard on every render:
+DATASET_MANIFEST = './data/dataset.json'
+
+# the columns the dashboard reads:
+DASHBOARD_CLASS_COLUMNS = ['id', 'title', 'image_url', 'instructor_id', 'instructor_name', 'fitness discipline',
+                           'duration', 'duration secs', 'premiere', 'average difficulty rating',
+                           'difficulty rating count', 'overall rating average', 'overall rating count',
+                           'total user workouts']
+
+# the class leaderboards of every instructor: metric they rank by, and whether the top is its largest or smallest value:
+LEADERBOARDS = {'most rated': ('overall rating count', 'largest'),
+                'highest rated': ('overall rating average', 'largest'),
+                'most difficult': ('average difficulty rating', 'largest'),
+                'lowest rated': ('overall rating average', 'smallest')}
+# classes only make the leaderboards once they've been out for this many days, to give them a chance to rack up
+# ratings:
+LEADERBOARD_LAG_DAYS = 15
+# number of classes kept on every leaderboard:
+LEADERBOARD_SIZE = 10
+
+# low cardinality columns stored as categoricals:
+CATEGORICAL_CLASS_COLUMNS = ['instructor_name', 'fitness discipline', 'duration', CLASS_STORE_PARTITION]
+
+
+# renames and transforms raw class records into the shape used by the dashboard:
+def prepare_class_frame(classes_df):
+    classes_df = classes_df.rename(columns=CLASS_COLUMN_NAMES)
+    classes_df['duration secs'] = classes_df['duration']
+    # format every distinct duration only once:
+    durations = classes_df['duration secs'].dropna().unique()
+    classes_df['duration'] = classes_df['duration secs'].map(dict(zip(durations, map(format_timespan, durations))))
+    classes_df['premiere'] = classes_df['premiere'].astype(str).str.split(' ').str[0]
+    classes_df['average difficulty rating'] = classes_df['average difficulty rating'].round(2)
+    classes_df['overall rating average'] = (classes_df['overall rating average'] * 100).round(2)
+
+    return classes_df
+
+
+# gives every column a single parquet friendly type: mixed object columns become strings, and the low cardinality
+# ones categoricals:
+def type_class_frame(classes_df):
+    classes_df = classes_df.copy()
+    for col in classes_df.columns[classes_df.dtypes == object]:
+        classes_df[col] = classes_df[col].where(classes_df[col].isna(), classes_df[col].astype(str))
+    for col in CATEGORICAL_CLASS_COLUMNS:
+        if col in classes_df:
+            classes_df[col] = classes_df[col].astype('category')
+
+    return classes_df
+
+
+# the class store is a compacted base (parquet, partitioned by discipline) plus an append-only log of delta segments
+# written by the syncs. manifest.json lists the files making up the current version of the store, and is swapped
+# atomically whenever segments are appended or compacted, so readers always see a complete version:
+#
+#   master_classes/
+#       manifest.json
+#       base-<version>/fitness_discipline=<discipline>/*.parquet
+#       segments/<version>.parquet
+
+
+# takes an exclusive lock on an open file, shared by every process: flock on posix, and a lock on the file's first byte
+# (msvcrt.locking) on windows. returns False instead of waiting when the lock is taken and blocking is False:
+def _lock_file(lock_file, blocking):
+    if os.name == 'nt':
+        import msvcrt
+        while True:
+            try:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+                return True
+            except OSError:
+                if not blocking:
+                    return False
+                time.sleep(0.05)
+
+    import fcntl
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+
+def _unlock_file(lock_file):
+    if os.name == 'nt':
+        import msvcrt
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# holds a file lock at path, serializing whatever runs under it across threads and processes. with blocking=False,
+# yields False right away instead of waiting when the lock is taken:
+@contextmanager
+def file_lock(path, blocking=True):
+    with open(path, 'a') as lock_file:
+        if not _lock_file(lock_file, blocking):
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            _unlock_file(lock_file)
+
+
+# serializes writers (appends and compactions) across threads and processes:
+@contextmanager
+def class_store_lock(store_dir=CLASS_STORE_DIR):
+    os.makedirs(store_dir, exist_ok=True)
+    with file_lock(os.path.join(store_dir, '.lock')):
+        yield
+
+
+# returns the manifest of the current store version, or None if the store has not been built yet:
+def read_manifest(store_dir=CLASS_STORE_DIR):
+    try:
+        with open(os.path.join(store_dir, 'manifest.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_manifest(store_dir, manifest):
+    tmp_path = os.path.join(store_dir, 'manifest.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(store_dir, 'manifest.json'))
+
+
+# writes a df to csv atomically, so that readers (and a crash mid-write) never see a partially written file:
+def write_csv_atomically(df, path, index=None):
+    tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+    df.to_csv(tmp_path, index=index)
+    os.replace(tmp_path, path)
+
+
+# writes a json file atomically (readers see either the old or the new file, never a partial one):
+def write_json_atomically(data, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_json(path, default=None):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return default
+
+
+# deletes the bases and segments no longer referenced by the manifest. the previous base and segments are kept around
+# (until the next compaction) for readers that may still be loading the previous version:
+def _remove_unreferenced_files(store_dir, manifest):
+    keep = ({manifest['base'], manifest.get('previous_base')} | set(manifest['segments']) |
+            set(manifest.get('previous_segments', [])))
+    for name in os.listdir(store_dir):
+        if name.startswith('base-') and name not in keep:
+            shutil.rmtree(os.path.join(store_dir, name), ignore_errors=True)
+    segments_dir = os.path.join(store_dir, 'segments')
+    for name in os.listdir(segments_dir):
+        if 'segments/' + name not in keep:
+            os.remove(os.path.join(segments_dir, name))
+
+
+# writes classes_df as the base of a new store version without segments, and swaps it in (callers hold the lock):
+def _replace_base(classes_df, store_dir, manifest):
+    version = manifest['version'] + 1
+    base = 'base-' + str(version)
+    classes_df = type_class_frame(classes_df)
+    partition_cols = [CLASS_STORE_PARTITION] if CLASS_STORE_PARTITION in classes_df else None
+    classes_df.to_parquet(os.path.join(store_dir, base), partition_cols=partition_cols, index=False)
+
+    # merged_version is the version whose classes the base holds (a compaction adds no classes of its own):
+    new_manifest = {'version': version,
+                    'base': base,
+                    'previous_base': manifest['base'],
+                    'segments': [],
+                    'previous_segments': manifest['segments'],
+                    'lineage': manifest.get('lineage', version),
+                    'merged_version': manifest['version']}
+    _write_manifest(store_dir, new_manifest)
+    _remove_unreferenced_files(store_dir, new_manifest)
+    return new_manifest
+
+
+# replaces the whole store with prepared class data. this starts a new lineage (kept through later appends and
+# compactions), telling the syncs that the classes in the store may have changed under them:
+def write_class_store(classes_df, store_dir=CLASS_STORE_DIR):
+    with class_store_lock(store_dir):
+        os.makedirs(os.path.join(store_dir, 'segments'), exist_ok=True)
+        manifest = read_manifest(store_dir) or {'version': 0, 'base': None, 'segments': []}
+        return _replace_base(classes_df, store_dir, dict(manifest, lineage=manifest['version'] + 1))
+
+
+# appends prepared new classes to the store as a delta segment. costs I/O proportional to the new rows only:
+def append_class_segment(classes_df, store_dir=CLASS_STORE_DIR):
+    with class_store_lock(store_dir):
+        manifest = read_manifest(store_dir)
+        # the first classes saved make up the base:
+        if manifest is None:
+            os.makedirs(os.path.join(store_dir, 'segments'), exist_ok=True)
+            return _replace_base(classes_df, store_dir, {'version': 0, 'base': None, 'segments': []})
+
+        version = manifest['version'] + 1
+        segment = 'segments/' + str(version) + '.parquet'
+        type_class_frame(classes_df).to_parquet(os.path.join(store_dir, segment), index=False)
+        manifest = dict(manifest, version=version, segments=manifest['segments'] + [segment])
+        _write_manifest(store_dir, manifest)
+
+    return manifest
+
+
+# merges the delta segments into a new base: newest record per class id, sorted by air time (newest first). does
+# nothing while there are fewer than min_segments segments:
+def compact_class_store(store_dir=CLASS_STORE_DIR, min_segments=1):
+    with class_store_lock(store_dir):
+        manifest = read_manifest(store_dir)
+        if manifest is None or len(manifest['segments']) < min_segments:
+            return manifest
+
+        classes_df = read_class_store(store_dir, columns=None, manifest=manifest)
+        if 'original_airtime' in classes_df:
+            classes_df = classes_df.sort_values(by='original_airtime', ascending=False)
+        return _replace_base(classes_df, store_dir, manifest)
+
+
+# runs compact_class_store in a background thread so the caller does not wait for it:
+def compact_class_store_in_background(store_dir=CLASS_STORE_DIR, min_segments=COMPACT_AFTER_SEGMENTS):
+    compaction = threading.Thread(target=compact_class_store, args=(store_dir, min_segments))
+    compaction.start()
+    return compaction
+
+
+# reads the given columns (None = all) of the current store version: the base plus any segments, keeping the newest
+# record of every class id. reads are memory mapped and only decode the requested columns:
+def read_class_store(store_dir=CLASS_STORE_DIR, columns=DASHBOARD_CLASS_COLUMNS, manifest=None):
+    manifest = manifest or read_manifest(store_dir)
+    if manifest is None:
+        return pd.DataFrame(columns=columns)
+
+    segments = [pd.read_parquet(os.path.join(store_dir, segment), columns=columns, memory_map=True)
+                for segment in reversed(manifest['segments'])]
+    base_df = pd.read_parquet(os.path.join(store_dir, manifest['base']), columns=columns, memory_map=True)
+    if not segments:
+        return base_df
+
+    classes_df = pd.concat(segments + [base_df], ignore_index=True)
+    if 'id' in classes_df:
+        classes_df = classes_df.drop_duplicates(subset=['id'], keep='first').reset_index(drop=True)
+    # categoricals with different categories come out of the concat as objects:
+    for col in CATEGORICAL_CLASS_COLUMNS:
+        if col in classes_df and classes_df[col].dtype == object:
+            classes_df[col] = classes_df[col].astype('category')
+
+    return classes_df
+
+
+# returns the set of class ids in the store, reading nothing but the id column:
+def read_class_ids(store_dir=CLASS_STORE_DIR):
+    return set(read_class_store(store_dir, columns=['id'])['id'])
+
+
+# returns the ids of the classes in the store and their air times (unix seconds), i.e. to start a sync cursor from.
+# stores that do not keep the air time to the minute fall back to the premiere date:
+def read_class_air_times(store_dir=CLASS_STORE_DIR):
+    try:
+        classes_df = read_class_store(store_dir, columns=['id', 'original_airtime'])
+    except ValueError:
+        classes_df = read_class_store(store_dir, columns=['id', 'premiere'])
+    air_times = pd.to_datetime(classes_df[classes_df.columns[1]].astype(object), errors='coerce')
+    found = air_times.notna()
+
+    return classes_df.loc[found, 'id'], air_times[found].astype('int64') // 10 ** 9
+
+
+# builds the class store from the master csv, the first time only. from then on the store is kept up to date by the
+# syncs alone, so the csv (which the syncs no longer write to) never replaces it, however recently it was touched. use
+# import_class_csv to merge a csv into an existing store:
+def ensure_class_store(csv_path=MASTER_CLASSES_CSV, store_dir=CLASS_STORE_DIR):
+    if os.path.exists(csv_path) and read_manifest(store_dir) is None:
+        import_class_csv(csv_path, store_dir)
+
+
+# merges the classes of a csv (i.e. a master file saved before the store) into the store, as a one-time import. the
+# classes the store already holds are kept as synced, and the rest are appended as a delta segment (or make up the
+# base of a new store). returns the number of classes imported:
+def import_class_csv(csv_path=MASTER_CLASSES_CSV, store_dir=CLASS_STORE_DIR):
+    classes_df = prepare_class_frame(pd.read_csv(csv_path, low_memory=False))
+    new_classes_df = classes_df[~classes_df['id'].isin(read_class_ids(store_dir))]
+    if not new_classes_df.empty:
+        append_class_segment(new_classes_df, store_dir)
+
+    return len(new_classes_df)
@@ -0,0 +1,78 @@
+import os
+import time
+from class_data_functions import read_json, write_json_atomically
+
+# watermark cursors of the feeds synced incrementally (the class archive, and the workouts of every instructor), kept
+# as one small json file per feed:
+#   data/sync/cursors/<feed>.json
+# a cursor holds the time and id of the newest record synced, plus the id and time of every record within
+# lookback_secs of it. feeds are served newest first, so a sync reads pages only until it gets past that window, and
+# never has to load the records saved so far. records showing up late (i.e. a class published a day after it aired)
+# are still picked up, as long as they fall within the window, since they are checked against the ids of the window.
+CURSOR_DIR = './data/sync/cursors/'
+CURSOR_LOOKBACK_SECS = 2 * 24 * 60 * 60
+
+
+class FeedCursor:
+    def __init__(self, feed, time_key, cursor_dir=CURSOR_DIR, lookback_secs=CURSOR_LOOKBACK_SECS):
+        self.feed = feed
+        self.time_key = time_key
+        self.path = os.path.join(cursor_dir, feed + '.json')
+        self.lookback_secs = lookback_secs
+        self.state = read_json(self.path, {})
+        # id -> time of the records within the window:
+        self.recent = self.state.pop('recent', {})
+
+    # whether the cursor was saved for the given source (whatever identifies the records saved so far, i.e. the
+    # lineage of the class store), as opposed to never saved or saved for records since replaced:
+    def matches(self, source):
+        return 'source' in self.state and self.state['source'] == source
+
+    # the feed's total when the cursor was last saved (None if unknown):
+    @property
+    def total(self):
+        return self.state.get('total')
+
+    # returns the records of a page the cursor has not seen, and whether the page got past the window (so that older
+    # pages need not be read):
+    def split_page(self, page_records):
+        if self.state.get('newest_time') is None:
+            return page_records, False
+        window_start = self.state['newest_time'] - self.lookback_secs
+        new_records = []
+        for record in page_records:
+            if record[self.time_key] < window_start:
+                return new_records, True
+            if record['id'] not in self.recent:
+                new_records.append(record)
+        return new_records, False
+
+    # moves the cursor past the given records, dropping the ids that fall out of the window:
+    def advance(self, records):
+        self._add([record['id'] for record in records], [record[self.time_key] for record in records])
+
+    # starts the cursor over from the ids and unix times of the records saved so far (i.e. the first time a feed is
+    # synced):
+    def reset(self, ids, times):
+        self.state = {}
+        self.recent = {}
+        self._add(ids, times)
+
+    def _add(self, ids, times):
+        newest_time = self.state.get('newest_time')
+        for record_id, record_time in zip(ids, times):
+            record_time = int(record_time)
+            self.recent[record_id] = record_time
+            if newest_time is None or record_time > newest_time:
+                newest_time = record_time
+                self.state['newest_id'] = record_id
+        if newest_time is not None:
+            self.state['newest_time'] = newest_time
+            window_start = newest_time - self.lookback_secs
+            self.recent = {record_id: record_time for record_id, record_time in self.recent.items()
+                           if record_time >= window_start}
+
+    # saves the cursor along with any other fields (i.e. the source and total of the feed):
+    def save(self, **fields):
+        self.state.update(fields, updated_at=time.time())
+        write_json_atomically(dict(self.state, recent=self.recent), self.path)
@@ -0,0 +1,170 @@
+import json
+import os
+import sqlite3
+from contextlib import closing
+from urllib.request import pathname2url
+import numpy as np
+import pandas as pd
+from class_data_functions import *
+
+# sqlite database of the classes the dashboard reads, kept up to date from the class store by the syncs (see
+# ensure_class_database). the dashboard queries the classes of the selected instructor and their aggregates from it,
+# instead of keeping the whole archive in the memory of every process:
+CLASS_DATABASE = CLASS_DATA_DIR + 'classes.sqlite'
+
+# column types of the classes table (the columns of the store read by the dashboard):
+CLASS_DATABASE_TYPES = {'id': 'TEXT PRIMARY KEY', 'title': 'TEXT', 'image_url': 'TEXT', 'instructor_id': 'TEXT',
+                        'instructor_name': 'TEXT', 'fitness discipline': 'TEXT', 'duration': 'TEXT',
+                        'duration secs': 'INTEGER', 'premiere': 'TEXT', 'average difficulty rating': 'REAL',
+                        'difficulty rating count': 'INTEGER', 'overall rating average': 'REAL',
+                        'overall rating count': 'INTEGER', 'total user workouts': 'INTEGER'}
+CLASS_DATABASE_INDEXES = {'classes_instructor': ['instructor_name', 'overall rating count'],
+                          'classes_discipline': ['fitness discipline'],
+                          'classes_premiere': ['premiere']}
+
+# the columns of the classes charted for the selected instructor:
+HERO_CLASS_COLUMNS = ['title', 'premiere', 'fitness discipline', 'duration', 'average difficulty rating',
+                      'difficulty rating count', 'overall rating average', 'overall rating count',
+                      'total user workouts']
+
+
+def _quote(column):
+    return '"' + column.replace('"', '""') + '"'
+
+
+# opens the database for writing, creating its tables and indexes if needed (only ensure_class_database writes to it):
+def _connect_class_database(db_path):
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('CREATE TABLE IF NOT EXISTS classes (' +
+                 ', '.join(_quote(col) + ' ' + col_type for col, col_type in CLASS_DATABASE_TYPES.items()) + ')')
+    for index, columns in CLASS_DATABASE_INDEXES.items():
+        conn.execute('CREATE INDEX IF NOT EXISTS ' + index + ' ON classes (' + ', '.join(map(_quote, columns)) + ')')
+    conn.execute('CREATE TABLE IF NOT EXISTS leaderboards (instructor_name TEXT, leaderboard TEXT, rank INTEGER, '
+                 'title TEXT, image_url TEXT, premiere TEXT, value, '
+                 'PRIMARY KEY (instructor_name, leaderboard, rank))')
+    conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+    conn.commit()
+    return conn
+
+
+# opens the database read-only, for the queries of the dashboard. run ensure_class_database first to create it:
+def read_class_database(db_path=CLASS_DATABASE):
+    return sqlite3.connect('file:' + pathname2url(os.path.abspath(db_path)) + '?mode=ro', uri=True, timeout=30)
+
+
+# the store version the database holds, or None when the sync has not built it yet (see ensure_class_database):
+def read_class_database_version(db_path=CLASS_DATABASE):
+    try:
+        with closing(read_class_database(db_path)) as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    except sqlite3.OperationalError:
+        return None
+
+    return int(row[0]) if row is not None else None
+
+
+# inserts (or replaces, by id) prepared classes into the classes table:
+def _upsert_classes(conn, classes_df):
+    classes_df = classes_df.reindex(columns=list(CLASS_DATABASE_TYPES))
+    classes_df = classes_df.astype(object).where(classes_df.notna(), None)
+    conn.executemany('INSERT OR REPLACE INTO classes VALUES (' + ', '.join('?' * len(classes_df.columns)) + ')',
+                     classes_df.values.tolist())
+
+
+# ranks the rated classes of every instructor for each leaderboard, and stores the top LEADERBOARD_SIZE of each in the
+# leaderboards table (replacing the previous ranking). only the classes premiered LEADERBOARD_LAG_DAYS days before
+# as_of are ranked:
+def _build_leaderboards(conn, as_of):
+    cutoff = (as_of - pd.Timedelta(days=LEADERBOARD_LAG_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
+    conn.execute('DELETE FROM leaderboards')
+    for leaderboard, (metric, order) in LEADERBOARDS.items():
+        conn.execute('INSERT INTO leaderboards '
+                     'SELECT instructor_name, ?, rank, title, image_url, premiere, value FROM ('
+                     'SELECT instructor_name, title, image_url, premiere, ' + _quote(metric) + ' AS value, '
+                     'ROW_NUMBER() OVER (PARTITION BY instructor_name ORDER BY ' + _quote(metric) +
+                     (' DESC' if order == 'largest' else '') + ', rowid) AS rank '
+                     'FROM classes WHERE "overall rating count" != 0 AND premiere < ? AND ' + _quote(metric) +
+                     ' IS NOT NULL) WHERE rank <= ?', [leaderboard, cutoff, LEADERBOARD_SIZE])
+
+
+# brings the database up to date with the class store, and returns the store version it holds. only the segments
+# appended since the last update are read, unless the store was replaced or compacted past them, in which case the
+# classes table is rebuilt from the whole store. the leaderboards are ranked again whenever the classes change, or the
+# day (as_of, today by default) moves their cutoff:
+def ensure_class_database(store_dir=CLASS_STORE_DIR, db_path=CLASS_DATABASE, as_of=None):
+    as_of = (as_of or pd.Timestamp.today()).normalize()
+    with closing(_connect_class_database(db_path)) as conn, class_store_lock(store_dir):
+        manifest = read_manifest(store_dir)
+        meta = dict(conn.execute('SELECT key, value FROM meta'))
+        if manifest is None:
+            return int(meta.get('version', 0))
+
+        source = json.dumps([os.path.abspath(store_dir), manifest.get('lineage')])
+        version = int(meta['version']) if meta.get('source') == source else -1
+        merged_version = manifest.get('merged_version', int(manifest['base'].split('-')[1]))
+        leaderboards_as_of = as_of.strftime('%Y-%m-%d')
+        if version == manifest['version'] and meta.get('leaderboards as of') == leaderboards_as_of:
+            return version
+
+        with conn:
+            if merged_version <= version < manifest['version']:
+                for segment in manifest['segments']:
+                    if int(os.path.basename(segment).split('.')[0]) > version:
+                        _upsert_classes(conn, pd.read_parquet(os.path.join(store_dir, segment)))
+            elif version != manifest['version']:
+                conn.execute('DELETE FROM classes')
+                _upsert_classes(conn, read_class_store(store_dir, DASHBOARD_CLASS_COLUMNS, manifest))
+            _build_leaderboards(conn, as_of)
+            conn.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                             [('source', source), ('version', str(manifest['version'])),
+                              ('leaderboards as of', leaderboards_as_of)])
+
+    return manifest['version']
+
+
+# the rated classes (overall rating count != 0) of an instructor:
+def query_instructor_classes(instructor, db_path=CLASS_DATABASE, columns=HERO_CLASS_COLUMNS):
+    with closing(read_class_database(db_path)) as conn:
+        return pd.read_sql('SELECT ' + ', '.join(map(_quote, columns)) + ' FROM classes '
+                           'WHERE instructor_name = ? AND "overall rating count" != 0', conn, params=[instructor])
+
+
+# the median of a column over the rated classes of an instructor (nulls skipped, as in pandas):
+def _median_sql(column):
+    rated = 'FROM classes WHERE instructor_name = :instructor AND "overall rating count" != 0 AND ' + column + \
+            ' IS NOT NULL'
+    return ('(SELECT AVG(' + column + ') FROM (SELECT ' + column + ' ' + rated + ' ORDER BY ' + column +
+            ' LIMIT 2 - (SELECT COUNT(*) ' + rated + ') % 2 OFFSET ((SELECT COUNT(*) ' + rated + ') - 1) / 2))')
+
+
+# the KPIs of an instructor's rated classes, aggregated by the database:
+def query_instructor_kpis(instructor, db_path=CLASS_DATABASE):
+    with closing(read_class_database(db_path)) as conn:
+        row = conn.execute('SELECT COUNT(*), SUM("total user workouts"), ' +
+                           _median_sql('"overall rating average"') + ', '
+                           'SUM("overall rating count") * 1.0 / COUNT(*), ' +
+                           _median_sql('"average difficulty rating"') + ', '
+                           'SUM("duration secs") / 3600.0 '
+                           'FROM classes WHERE instructor_name = :instructor AND "overall rating count" != 0',
+                           {'instructor': instructor}).fetchone()
+
+    values = [np.nan if value is None else value for value in row]
+    return dict(zip(['total classes', 'total user workouts', 'median rating', 'ratings per class',
+                     'median difficulty rating', 'total hours'], values))
+
+
+# the leaderboards of an instructor, as ranked by the last ensure_class_database: {leaderboard: top k classes}, each
+# holding the title, image_url and premiere of the classes along with their metric as 'value'. classes only make them
+# LEADERBOARD_LAG_DAYS days after premiering:
+def query_instructor_leaderboards(instructor, k=LEADERBOARD_SIZE, db_path=CLASS_DATABASE):
+    leaderboards = {}
+    with closing(read_class_database(db_path)) as conn:
+        for leaderboard in LEADERBOARDS:
+            leaderboards[leaderboard] = pd.read_sql(
+                'SELECT title, image_url, premiere, value FROM leaderboards '
+                'WHERE instructor_name = ? AND leaderboard = ? AND rank <= ? ORDER BY rank', conn,
+                params=[instructor, leaderboard, k])
+
+    return leaderboards
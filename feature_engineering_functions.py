@@ -1,64 +1,47 @@
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
-from pandas.api.types import CategoricalDtype
+from datetime import timedelta
+
+
+# ordered categories of the derived date/time columns:
+DAYS_OF_WEEK = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+TIMES_OF_DAY = ['early morning', 'morning', 'early afternoon', 'evening', 'late night']
+# upper bounds (in military time) of each time of day:
+TIME_OF_DAY_BINS = [-np.inf, 600, 1200, 1700, 2100, np.inf]
+
+
+# parses timestamps like '2021-10-17 12:11 (-04)' or '2021-10-17 12:11' in one go, keeping the local time (i.e.
+# dropping any trailing utc offset). columns that are already datetimes are returned as they are:
+def parse_timestamps(series):
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    return pd.to_datetime(series.astype(str).str[:16], format='%Y-%m-%d %H:%M')
 
 
 # returns day of the week:
 def day_of_week(df, col):
-    # remove last 6 characters:
-    df['day_of_week'] = [x[:-6] for x in df[col]]
-    # convert to day of week:
-    df['day_of_week'] = pd.to_datetime(df['day_of_week']).dt.day_name()
-    day_of_week_lst = df['day_of_week'].tolist()
-    df.drop(labels='day_of_week', axis=1, inplace=True)
-    return day_of_week_lst
+    days = parse_timestamps(df[col]).dt.day_name()
+    return pd.Categorical(days, categories=DAYS_OF_WEEK, ordered=True)
 
 
 # returns date without trailing (-#):
 def date_cleaner(df, date_col, remove_last_n_chars):
-    # remove last 6 characters:
-    df['new_datetime'] = [x[:remove_last_n_chars] for x in df[date_col]]
-    # convert to day of week:
-    df['new_datetime'] = pd.to_datetime(df['new_datetime'])
-    cleaned_date_lst = df['new_datetime'].tolist()
-    df.drop(labels='new_datetime', axis=1, inplace=True)
-    return cleaned_date_lst
+    # remove trailing characters and convert to datetime:
+    return pd.to_datetime(df[date_col].astype(str).str[:remove_last_n_chars]).to_numpy()
 
 
 # returns the discretized time of day:
 def time_of_day(df, col):
-    # get middle 5 characters and strip colon, essentially turning it into military time.
-    # converts to integer for comparison:
-    df['time_of_day'] = [int(str(x).split(' ')[1].replace(':', '')) for x in df[col]]
-    time_of_day_lst = []
-    
-    # discretize hours
-    for tod in df['time_of_day']:
-        if tod <= 600:
-            time_of_day_lst.append('early morning')
-        elif 600 < tod <= 1200:
-            time_of_day_lst.append('morning')
-        elif 1200 < tod <= 1700:
-            time_of_day_lst.append('early afternoon')
-        elif 1700 < tod <= 2100:
-            time_of_day_lst.append('evening')
-        else:
-            time_of_day_lst.append('late night')
-            
-    df.drop(labels='time_of_day', axis=1, inplace=True)
-    return time_of_day_lst
-
-
-# returns the month of the year i.e. October-21:
+    # turn the time into military time (i.e. 13:45 -> 1345) and bucket it:
+    timestamps = parse_timestamps(df[col])
+    military_time = (timestamps.dt.hour * 100 + timestamps.dt.minute).to_numpy()
+    return pd.cut(military_time, bins=TIME_OF_DAY_BINS, labels=TIMES_OF_DAY)
+
+
+# returns the month of the year i.e. October-21, with chronologically ordered categories:
 def month_of_year(df, col):
-    df['month_of_year'] = [str(x).split(' ')[0] for x in df[col]]
-    dates = pd.to_datetime(df['month_of_year'])
-    df['month_of_year'] = dates.apply(lambda x: x.strftime('%B-%y'))
-    month_of_year_lst = df['month_of_year'].tolist()
-    
-    df.drop(labels='month_of_year', axis=1, inplace=True)
-    return month_of_year_lst
+    months = pd.Categorical(parse_timestamps(df[col]).dt.to_period('M'), ordered=True)
+    return months.rename_categories(months.categories.strftime('%B-%y'))
 
 
 # get ride type:
@@ -73,24 +56,15 @@ def get_hero(df, y):
     hero = df.loc[df[y].idxmax(), "Instructor Name"]
 
 
-# get longest workout streak
+# get longest workout streak:
 def longest_streak(df, date_col):
-    i0max, i1max = 0, 0
-    i0 = 0
-    for i1, date in enumerate(df[date_col]):
-        if date - df[date_col][i0] != np.timedelta64(i1-i0, 'D'):
-            if i1 - i0 > i1max - i0max:
-                i0max, i1max = i0, i1
-            i0 = i1
-    longest_streak = len(df[date_col][i0max:i1max])
-    return longest_streak
+    return streak_summary(df, date_col)['longest']
 
 
 # get total workout time (hours):
 def get_total_workout_time(df, time_col):
-    df[time_col].replace('None', 0, inplace=True)
-    minutes = [int(x) for x in df[time_col]]
-    total = round(sum(minutes)/60, 2)
+    minutes = pd.to_numeric(df[time_col].replace('None', 0), errors='coerce').fillna(0)
+    total = round(minutes.sum()/60, 2)
     return total
 
 
@@ -108,6 +82,45 @@ def hardest_workout_metrics(df, outputcol, durationcol, targetcol):
     return t
 
 
+# adds the derived date/time and title columns to a copy of a workouts export:
+def enrich_workouts(df):
+    df = df.copy()
+    df.columns = df.columns.map(str)
+    df['workout: datetime'] = parse_timestamps(df['Workout Timestamp']).dt.normalize()
+    df['workout: day of week'] = day_of_week(df, 'Workout Timestamp')
+    df['workout: time of day'] = time_of_day(df, 'Workout Timestamp')
+    df['workout: month and year'] = month_of_year(df, 'Workout Timestamp')
+    df['workout: title'] = df['Title']
+    return df
+
+
+# computes the KPIs shown at the top of the dashboard from an enriched workouts df:
+def workout_kpis(df):
+    kpis = {}
+    kpis['total workouts'] = int(df['Workout Timestamp'].count().sum())
+    kpis['total calories'] = int(df['Calories Burned'].sum())
+
+    # favorite instructor and their number of workouts:
+    instructor_counts = df.groupby(['Instructor Name'])['Instructor Name'].count().sort_values(ascending=False)
+    kpis['favorite instructor'] = str(instructor_counts.index[0])
+    kpis['favorite instructor workouts'] = int(instructor_counts.iloc[0])
+
+    # hardest workout, on a copy without the workouts of unknown length:
+    length = pd.to_numeric(df['Length (minutes)'], errors='coerce')
+    hwo_df = df[length.notna()].copy()
+    hwo_df['calories per minute'] = pd.to_numeric(hwo_df['Calories Burned'], errors='coerce').fillna(0.0001) / \
+                                    pd.to_numeric(hwo_df['Length (minutes)'], errors='coerce').fillna(0.0001)
+    kpis['hardest workout'] = hardest_workout_metrics(hwo_df, 'Calories Burned', 'Length (minutes)', 'Title')
+    kpis['hardest workout instructor'] = hardest_workout_metrics(hwo_df, 'Calories Burned', 'Length (minutes)',
+                                                                 'Instructor Name')
+    kpis['hardest workout calories/minute'] = hardest_workout_metrics(hwo_df, 'Calories Burned', 'Length (minutes)',
+                                                                      'calories per minute')
+
+    kpis['total hours'] = get_total_workout_time(df, 'Length (minutes)')
+    kpis['longest streak'] = streak_summary(df, 'workout: datetime')['longest']
+    return kpis
+
+
 # checks for consecutive dates:
 def is_consecutive(date1, date2):
     return True if date1 + timedelta(days=1) == date2 else False
@@ -115,26 +128,68 @@ def is_consecutive(date1, date2):
 
 # get longest workout streak (new version):
 def longest_streak2(df, date_col):
-    date_list = [x for x in df[date_col]]
-    date_list = list(set(date_list))
-
-    date_list.sort()
-    res = {}
-    start_date = date_list[0]
-    cnt = 1
-    for idx, cur_date in enumerate(date_list[1:], start=1):
-        # print(idx, cur_date)
-        if is_consecutive(date_list[idx - 1], cur_date):
-            cnt += 1
-        else:
-            res[start_date] = cnt
-            start_date = cur_date
-            cnt = 1
-    else:
-        res[start_date] = cnt
+    return streak_summary(df, date_col)['longest']
+
+
+# streaks are computed on integer period ordinals: days since the epoch for daily streaks, and monday based weeks
+# since the epoch for weekly ones (1970-01-01 was a thursday):
+def period_ordinals(dates, freq='D'):
+    days = pd.to_datetime(dates).to_numpy().astype('datetime64[D]').astype('int64')
+    return days if freq == 'D' else (days + 3) // 7
 
-    max_key = max(res, key=res.get)
-    max_val = res.get(max_key)
-    return max_val
 
+# converts period ordinals back to dates (weeks become their monday):
+def ordinal_dates(ordinals, freq='D'):
+    days = ordinals if freq == 'D' else ordinals * 7 - 3
+    return pd.to_datetime(days.astype('datetime64[D]'))
 
+
+# returns every streak of consecutive workout days (freq='D') or weeks (freq='W') as rows of start, end and length,
+# longest first. when given a column to break streaks down by (i.e. 'Fitness Discipline'), the streaks of every
+# group are found in the same pass by offsetting each group's ordinals so that groups never run into each other:
+def workout_streaks(df, date_col, freq='D', by=None):
+    dates = pd.to_datetime(df[date_col])
+    if getattr(dates.dt, 'tz', None) is not None:
+        dates = dates.dt.tz_localize(None)
+    valid = dates.notna().to_numpy()
+    ordinals = period_ordinals(dates[valid], freq)
+
+    if by is None:
+        codes, groups = np.zeros(len(ordinals), dtype='int64'), None
+    else:
+        codes, groups = pd.factorize(df[by][valid])
+        ordinals, codes = ordinals[codes >= 0], codes[codes >= 0].astype('int64')
+
+    # unique (group, period) keys, sorted by group then period:
+    group_stride = 1 << 32
+    keys = np.unique(codes * group_stride + ordinals)
+    run_starts = np.flatnonzero(np.diff(keys, prepend=keys[:1] - 2) != 1)
+    run_lengths = np.diff(np.append(run_starts, len(keys)))
+    run_groups, start_ordinals = np.divmod(keys[run_starts], group_stride)
+
+    runs = pd.DataFrame({'start': ordinal_dates(start_ordinals, freq),
+                         'end': ordinal_dates(start_ordinals + run_lengths - 1, freq),
+                         'length': run_lengths})
+    if by is not None:
+        runs.insert(0, by, groups.take(run_groups))
+
+    return runs.sort_values(by=['length', 'end'], ascending=False, ignore_index=True)
+
+
+# returns the longest and current streaks, and the top_n streaks. the current streak is the one that includes today
+# or the previous period (i.e. yesterday), since that streak can still be extended today. with a by column, longest
+# and current are series indexed by group, and top holds the top_n streaks of each group:
+def streak_summary(df, date_col, freq='D', by=None, top_n=5, today=None):
+    runs = workout_streaks(df, date_col, freq, by)
+    current_period = period_ordinals([today or pd.Timestamp.today()], freq)[0]
+    ongoing = period_ordinals(runs['end'], freq) >= current_period - 1
+    current_lengths = runs['length'].where(ongoing, 0)
+
+    if by is None:
+        return {'longest': int(runs['length'].max()) if len(runs) else 0,
+                'current': int(current_lengths.max()) if len(runs) else 0,
+                'top': runs.head(top_n)}
+
+    return {'longest': runs.groupby(by, sort=False)['length'].max(),
+            'current': current_lengths.groupby(runs[by], sort=False).max(),
+            'top': runs.groupby(by, sort=False).head(top_n).reset_index(drop=True)}
@@ -0,0 +1,90 @@
+import re
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# schema of peloton's workout export (the csv downloaded from Workouts > DOWNLOAD WORKOUTS):
+# timestamps look like '2021-10-17 12:11 (-04)', a local time followed by its utc offset:
+EXPORT_TIMESTAMP_COLUMNS = ['Workout Timestamp', 'Class Timestamp']
+EXPORT_CATEGORICAL_COLUMNS = ['Live/On-Demand', 'Instructor Name', 'Fitness Discipline', 'Type']
+# numbers, where missing values show up as blanks or 'None':
+EXPORT_NUMERIC_COLUMNS = ['Length (minutes)', 'Total Output', 'Avg. Watts', 'Avg. Resistance', 'Avg. Cadence (RPM)',
+                          'Avg. Speed (mph)', 'Distance (mi)', 'Calories Burned', 'Avg. Heartrate', 'Avg. Incline',
+                          'Avg. Pace (min/mi)']
+# numbers exported as percentages (i.e. '44%'):
+EXPORT_PERCENT_COLUMNS = ['Avg. Resistance']
+
+# rows read at a time, which bounds the memory used by the raw strings of large exports:
+EXPORT_CHUNK_SIZE = 50000
+
+# utc offsets (in hours) of the timezone abbreviations found in some exports instead of numeric offsets:
+TIMEZONE_OFFSETS = {'UTC': 0, 'GMT': 0, 'EST': -5, 'EDT': -4, 'CST': -6, 'CDT': -5, 'MST': -7, 'MDT': -6,
+                    'PST': -8, 'PDT': -7}
+
+_offset_pattern = re.compile(r'\(([+-])(\d{1,2}):?(\d{2})?\)$')
+
+
+# parses export timestamps once. returns the local time (offset dropped, as shown in the export) and the
+# timezone-aware utc time:
+def parse_export_timestamps(series):
+    local = pd.to_datetime(series.str[:16], format='%Y-%m-%d %H:%M', errors='coerce')
+
+    # offsets are parsed once per distinct suffix, since an export only holds a handful of them:
+    suffixes = series.str[17:]
+    offset_hours = {}
+    for suffix in suffixes.dropna().unique():
+        match = _offset_pattern.match(suffix)
+        if match:
+            sign = -1 if match.group(1) == '-' else 1
+            offset_hours[suffix] = sign * (int(match.group(2)) + int(match.group(3) or 0) / 60)
+        else:
+            offset_hours[suffix] = TIMEZONE_OFFSETS.get(suffix.strip('()'))
+    offsets = pd.to_timedelta(suffixes.map(offset_hours).astype(float), unit='h')
+
+    return local, (local - offsets).dt.tz_localize('UTC')
+
+
+# gives a chunk of export rows the types declared in the schema. read_csv already parsed the numbers and
+# categoricals it could, so only what's left (percentages, stray strings, timestamps) is converted here:
+def type_export_chunk(chunk_df):
+    # drop the header rows of any other exports concatenated into the same file:
+    header_rows = chunk_df[chunk_df.columns[0]] == chunk_df.columns[0]
+    if header_rows.any():
+        chunk_df = chunk_df[~header_rows].copy()
+        for col in EXPORT_CATEGORICAL_COLUMNS:
+            if col in chunk_df:
+                chunk_df[col] = chunk_df[col].cat.remove_unused_categories()
+
+    for col in EXPORT_TIMESTAMP_COLUMNS:
+        if col in chunk_df:
+            chunk_df[col], chunk_df[col + ' (UTC)'] = parse_export_timestamps(chunk_df[col])
+    for col in EXPORT_NUMERIC_COLUMNS:
+        if col in chunk_df and chunk_df[col].dtype == object:
+            values = chunk_df[col].str.rstrip('%') if col in EXPORT_PERCENT_COLUMNS else chunk_df[col]
+            chunk_df[col] = pd.to_numeric(values, errors='coerce')
+
+    return chunk_df
+
+
+# reads one or more workout exports (paths or file objects) chunk by chunk, typing every chunk as it is read. the
+# categorical columns of all chunks are unified at the end so that they concatenate without falling back to strings.
+# only the parse is chunked: the raw strings of a single chunk are held at a time, but the typed chunks are all kept
+# until the final concat, so memory still grows with the export (about twice its typed size at the concat):
+def read_workout_export(sources, chunksize=EXPORT_CHUNK_SIZE):
+    if not isinstance(sources, (list, tuple)):
+        sources = [sources]
+
+    dtypes = {col: str for col in EXPORT_TIMESTAMP_COLUMNS}
+    dtypes.update({col: 'category' for col in EXPORT_CATEGORICAL_COLUMNS})
+
+    chunks = []
+    for source in sources:
+        for chunk_df in pd.read_csv(source, dtype=dtypes, na_values=['None'], chunksize=chunksize):
+            chunks.append(type_export_chunk(chunk_df))
+
+    for col in EXPORT_CATEGORICAL_COLUMNS:
+        if chunks and col in chunks[0]:
+            categories = union_categoricals([chunk_df[col] for chunk_df in chunks]).categories
+            for chunk_df in chunks:
+                chunk_df[col] = chunk_df[col].cat.set_categories(categories)
+
+    return pd.concat(chunks, ignore_index=True)
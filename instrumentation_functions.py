@@ -0,0 +1,123 @@
+import bisect
+import json
+import logging
+import os
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+# hot path instrumentation: wall-clock timers for the sections of a dashboard render, and per endpoint counters of the
+# api requests (count, statuses, bytes and a latency histogram). switched on with PELOTON_INSTRUMENTATION=1, and
+# written as json lines to PELOTON_INSTRUMENTATION_LOG (or stderr). when off, every hook returns right away:
+INSTRUMENTATION_ENABLED = os.environ.get('PELOTON_INSTRUMENTATION', '').lower() not in ('', '0', 'false', 'no')
+INSTRUMENTATION_LOG = os.environ.get('PELOTON_INSTRUMENTATION_LOG')
+
+# upper bounds (in seconds) of the request latency histogram buckets:
+LATENCY_BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf')]
+
+logger = logging.getLogger('peloton.instrumentation')
+logger.propagate = False
+if INSTRUMENTATION_ENABLED and not logger.handlers:
+    _handler = logging.FileHandler(INSTRUMENTATION_LOG) if INSTRUMENTATION_LOG else logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+
+# groups urls by endpoint, replacing the ids in their paths (i.e. /api/workout/{id}):
+def endpoint_name(url):
+    path = urlsplit(url).path
+    return re.sub(r'/(instructor|user|workout|ride)/(?!archived|metadata_mappings)[^/]+', r'/\1/{id}', path)
+
+
+# process wide counters, shared by every thread:
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.sections = {}
+            self.endpoints = {}
+
+    def add_section(self, name, seconds):
+        with self._lock:
+            section = self.sections.setdefault(name, {'count': 0, 'total secs': 0, 'last secs': 0, 'max secs': 0})
+            section['count'] += 1
+            section['total secs'] += seconds
+            section['last secs'] = seconds
+            section['max secs'] = max(section['max secs'], seconds)
+
+    def add_request(self, endpoint, status, size, seconds):
+        with self._lock:
+            counters = self.endpoints.setdefault(endpoint, {'requests': 0, 'bytes': 0, 'total secs': 0,
+                                                            'statuses': {}, 'latency': [0] * len(LATENCY_BUCKETS)})
+            counters['requests'] += 1
+            counters['bytes'] += size
+            counters['total secs'] += seconds
+            counters['statuses'][status] = counters['statuses'].get(status, 0) + 1
+            counters['latency'][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    # a json friendly copy of the counters:
+    def snapshot(self):
+        with self._lock:
+            sections = {name: {key: round(value, 4) if isinstance(value, float) else value
+                               for key, value in section.items()} for name, section in self.sections.items()}
+            endpoints = {}
+            for endpoint, counters in self.endpoints.items():
+                endpoints[endpoint] = {'requests': counters['requests'],
+                                       'bytes': counters['bytes'],
+                                       'avg secs': round(counters['total secs'] / counters['requests'], 4),
+                                       'statuses': {str(status): count
+                                                    for status, count in counters['statuses'].items()},
+                                       'latency': {('<=' + str(bound) if bound != float('inf') else '>' +
+                                                    str(LATENCY_BUCKETS[-2])): count
+                                                   for bound, count in zip(LATENCY_BUCKETS, counters['latency'])
+                                                   if count}}
+        return {'sections': sections, 'endpoints': endpoints}
+
+
+metrics = Metrics()
+
+
+# writes one json log line:
+def log_event(event, **fields):
+    if INSTRUMENTATION_ENABLED:
+        logger.info(json.dumps(dict({'ts': round(time.time(), 3), 'event': event}, **fields), default=str))
+
+
+# times consecutive sections of a script: every lap(name) records the time since the previous lap (or since the
+# timer was made), so sections are marked where they end without re-indenting them. finish() logs the whole run:
+class SectionTimer:
+    def __init__(self, run_name):
+        self.run_name = run_name
+        self.laps = {}
+        self._start = self._last = time.perf_counter()
+
+    def lap(self, name):
+        if not INSTRUMENTATION_ENABLED:
+            return
+        now = time.perf_counter()
+        self.laps[name] = now - self._last
+        metrics.add_section(name, self.laps[name])
+        self._last = now
+
+    def finish(self, **fields):
+        if not INSTRUMENTATION_ENABLED:
+            return
+        log_event(self.run_name, total_secs=round(time.perf_counter() - self._start, 4),
+                  sections={name: round(seconds, 4) for name, seconds in self.laps.items()}, **fields)
+
+
+# counts an api request (every attempt, retries included):
+def record_request(url, response, seconds):
+    if INSTRUMENTATION_ENABLED:
+        metrics.add_request(endpoint_name(url), response.status_code, len(response.content), seconds)
+
+
+# logs the request counters, the given cache stats and any other fields, i.e. at the end of a sync:
+def log_metrics(event, caches=None, **fields):
+    if INSTRUMENTATION_ENABLED:
+        log_event(event, endpoints=metrics.snapshot()['endpoints'], caches=caches, **fields)
@@ -1,18 +1,24 @@
+import hashlib
 import pandas as pd
 import streamlit as st
-import plotly.express as px
 from feature_engineering_functions import *
 from EDA_functions import *
 from os import listdir
 from os.path import isfile, join
 from api_functions import *
-from humanfriendly import format_timespan
-from datetime import datetime, timedelta
+from class_data_functions import *
+from ingest_functions import *
+from cache_functions import FigureCache
+from instrumentation_functions import *
+from database_functions import *
 
 
 # set global page layout:
 st.set_page_config(page_title='Peloton Workouts Dashboard', page_icon="./images/pelo_black2.png", layout="wide")
 
+# times every section of the render (when PELOTON_INSTRUMENTATION is on):
+render_timer = SectionTimer('render')
+
 ########################################################################################################################
 # About section:
 ########################################################################################################################
@@ -77,29 +83,46 @@ st.markdown('---')
 uploaded_file = st.file_uploader("Upload .csv")
 
 
-# cache files to decrease latency:
-@st.experimental_memo()
 def load_workout_file(uploaded_file):
     if uploaded_file is not None:
-        df = pd.read_csv(uploaded_file)
+        df = read_workout_export(uploaded_file)
     else:
-        df = pd.read_csv("./data/my_workouts.csv")
+        df = read_workout_export("./data/my_workouts.csv")
     return df
 
 
+# content hash of the workouts file, everything derived from the file is cached under it:
+def workout_file_fingerprint(uploaded_file):
+    if uploaded_file is not None:
+        return hashlib.sha1(uploaded_file.getvalue()).hexdigest()
+    with open("./data/my_workouts.csv", 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+# cache the enriched workouts and their KPIs, so that widget interactions only re-render charts:
+@st.experimental_memo()
+def load_workouts(fingerprint, _uploaded_file):
+    df = enrich_workouts(load_workout_file(_uploaded_file))
+    return df, workout_kpis(df)
+
+
 # load:
-df = load_workout_file(uploaded_file)
+workouts_fingerprint = workout_file_fingerprint(uploaded_file)
+df, kpis = load_workouts(workouts_fingerprint, uploaded_file)
+
+
+# finished figures shared by every session, keyed on (dataset fingerprint, chart id, selected options):
+@st.experimental_singleton()
+def get_figure_cache():
+    return FigureCache()
+
+
+figure_cache = get_figure_cache()
+render_timer.lap('load workouts')
 
 ########################################################################################################################
 # KPIs:
 ########################################################################################################################
-# basic feature engineering:
-df['workout: datetime'] = date_cleaner(df, 'Workout Timestamp', 10)
-df['workout: day of week'] = day_of_week(df, 'Workout Timestamp')
-df['workout: time of day'] = time_of_day(df, 'Workout Timestamp')
-df['workout: month and year'] = month_of_year(df, 'Workout Timestamp')
-df['workout: title'] = df['Title']
-
 # get list of instructors:
 img_path = "./images/"
 instructor_lst = [f.split('.png')[0] for f in listdir(img_path) if isfile(join(img_path, f))]
@@ -113,22 +136,18 @@ st.markdown('---')
 # kpi0, kpi1, kpi2, kpi3 = st.columns([0.5, 1.5, 1.7, 1])
 kpi0, kpi1, kpi2, kpi3, kpi4, kpi5, kpi6 = st.columns([0.2, 1, 1, 1, 1, 1, 1])
 
-# get KPI data and write to KPIs:
+# write KPIs:
 with kpi1:
-    total_workouts = int(df["Workout Timestamp"].count().sum())
-    kpi1.metric(label='Total Workouts:', value=total_workouts)
+    kpi1.metric(label='Total Workouts:', value=kpis['total workouts'])
 
 with kpi2:
-    total_cals = "{:,}".format(int(df['Calories Burned'].sum()))
+    total_cals = "{:,}".format(kpis['total calories'])
     kpi2.metric(label='Total Calories Burned:', value=total_cals)
 
 with kpi3:
-    # get favorite instructor name:
-    favorite_instructor = str(df.groupby(["Instructor Name"])["Instructor Name"].count().sort_values(
-        ascending=False).index.tolist()[0])
-    # get number of workouts:
-    num_workouts = str(df.groupby(["Instructor Name"])["Instructor Name"].count().sort_values(
-        ascending=False)[0])
+    # get favorite instructor name and number of workouts:
+    favorite_instructor = kpis['favorite instructor']
+    num_workouts = str(kpis['favorite instructor workouts'])
 
     # get top instructor image:
     hero_img = "./images/" + favorite_instructor + ".png"
@@ -137,17 +156,9 @@ with kpi3:
     kpi3.metric(label='Number of workouts:', value=num_workouts)
 
 with kpi4:
-    # create a copy for 'hardest workout' calculations:
-    hwo_df = df.copy()
-    hwo_df = hwo_df.drop(df[df['Length (minutes)'] == 'None'].index)
-    hwo_df['average output/minute'] = pd.to_numeric(hwo_df['Total Output'], errors='coerce').fillna(0.0001) / \
-                                      pd.to_numeric(hwo_df['Length (minutes)'], errors='coerce').fillna(0.0001)
-    hwo_df['calories per minute'] = pd.to_numeric(hwo_df['Calories Burned'], errors='coerce').fillna(0.0001) / \
-                                    pd.to_numeric(hwo_df['Length (minutes)'], errors='coerce').fillna(0.0001)
-
-    workout_title = hardest_workout_metrics(hwo_df, 'Calories Burned', 'Length (minutes)', 'Title')
-    instructor = hardest_workout_metrics(hwo_df, 'Calories Burned', 'Length (minutes)', 'Instructor Name')
-    output_metric = hardest_workout_metrics(hwo_df, 'Calories Burned', 'Length (minutes)', 'calories per minute')
+    workout_title = kpis['hardest workout']
+    instructor = kpis['hardest workout instructor']
+    output_metric = kpis['hardest workout calories/minute']
 
     if instructor not in instructor_lst:
         kpi4.metric(label='Hardest Workout: ' + workout_title, value=instructor)
@@ -161,15 +172,15 @@ with kpi4:
     kpi4.metric(label='Avg. calories/minute:', value=str("{:.1f}".format(output_metric)))
 
 with kpi5:
-    total_time = get_total_workout_time(df, 'Length (minutes)')
+    total_time = kpis['total hours']
     kpi5.metric(label='Total Workout Time:', value=str("{:,}".format(total_time)) + ' hours')
 
 with kpi6:
-    df.columns = df.columns.map(str)
-    streak = longest_streak2(df, 'workout: datetime')
+    streak = kpis['longest streak']
     kpi6.metric(label='Longest Consecutive Streak:', value=str(streak) + ' days')
 
 st.markdown('---')
+render_timer.lap('kpis')
 
 
 ########################################################################################################################
@@ -181,7 +192,9 @@ with c1:
         "break down 'Time of Day' by: ",
         ('Type', 'Fitness Discipline', 'Live/On-Demand'), index=0)
     array_tod = ['early morning', 'morning', 'early afternoon', 'evening', 'late night']
-    figc1 = count_histogram(df, x='workout: time of day', color=hue1, w=700, h=600, array_l=array_tod)
+    figc1 = figure_cache.get_or_build(
+        (workouts_fingerprint, 'time of day', hue1),
+        lambda: count_histogram(df, x='workout: time of day', color=hue1, w=700, h=600, array_l=array_tod))
     st.plotly_chart(figc1)
 
 with c2:
@@ -189,17 +202,19 @@ with c2:
         "break down 'Day of Week' by: ",
         ('Type', 'Fitness Discipline', 'Live/On-Demand'), index=0)
     array_dow = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-    figc2 = count_histogram(df, x='workout: day of week', color=hue2, w=700, h=600, array_l=array_dow)
+    figc2 = figure_cache.get_or_build(
+        (workouts_fingerprint, 'day of week', hue2),
+        lambda: count_histogram(df, x='workout: day of week', color=hue2, w=700, h=600, array_l=array_dow))
     st.plotly_chart(figc2)
 
 with c3:
     hue3 = st.radio(
         "break down 'Month and Year' by: ",
         ('Type', 'Fitness Discipline', 'Live/On-Demand'), index=0)
-    dates = month_of_year(df, 'Workout Timestamp')
-    array_dates = []
-    array_dates = [array_dates.append(x) for x in dates if x not in array_dates]
-    figc3 = count_histogram(df, x='workout: month and year', color=hue3, w=700, h=600, array_l=array_dates)
+    array_dates = list(df['workout: month and year'].cat.categories)
+    figc3 = figure_cache.get_or_build(
+        (workouts_fingerprint, 'month and year', hue3),
+        lambda: count_histogram(df, x='workout: month and year', color=hue3, w=700, h=600, array_l=array_dates))
     st.plotly_chart(figc3)
 
 st.markdown('---')
@@ -213,8 +228,10 @@ column_left, column_middle, column_right = st.columns([1, 1, 1])
 # write to columns:
 with column_left:
     option = st.selectbox("Calories Burned vs. Instructor: ", ['avg', 'sum', 'count'], index=1)
-    fig = histogram(df, x="Instructor Name", y="Calories Burned", func=option, w=700, h=600)
-    fig.update_xaxes(tickangle=45)
+    fig = figure_cache.get_or_build(
+        (workouts_fingerprint, 'calories by instructor', option),
+        lambda: histogram(df, x="Instructor Name", y="Calories Burned", func=option, w=700, h=600)
+        .update_xaxes(tickangle=45))
     st.plotly_chart(fig)
 
 with column_middle:
@@ -222,14 +239,19 @@ with column_middle:
                                                               "Distance (mi)", "Avg. Speed (mph)",
                                                               "Avg. Cadence (RPM)",
                                                               "Avg. Resistance"], index=5)
-    fig_heat = heatmap(df, x="Avg. Heartrate", y=option, w=700, h=600)
+    fig_heat = figure_cache.get_or_build(
+        (workouts_fingerprint, 'heartrate heatmap', option),
+        lambda: heatmap(df, x="Avg. Heartrate", y=option, w=700, h=600))
     st.plotly_chart(fig_heat)
 
 with column_right:
     option = st.selectbox("Calories Burned vs. Workout Title: ", ['avg', 'sum', 'count'], index=1)
-    fig2 = histogram(df, x='workout: title', y="Calories Burned", func=option, w=700, h=600)
-    fig2.update_xaxes(tickangle=45)
+    fig2 = figure_cache.get_or_build(
+        (workouts_fingerprint, 'calories by title', option),
+        lambda: histogram(df, x='workout: title', y="Calories Burned", func=option, w=700, h=600)
+        .update_xaxes(tickangle=45))
     st.plotly_chart(fig2)
+render_timer.lap('charts')
 
 ########################################################################################################################
 # Instructor section:
@@ -237,33 +259,59 @@ with column_right:
 st.markdown("""<hr style="height:4px;border:none;color:#d8d4dc;background-color:#d8d4dc;" /> """, unsafe_allow_html=True)
 st.markdown('### Peloton Heroes and their Class Stats:')
 
+# the dataset published by the sync (sync_functions.py, run as its own process). the class and instructor data is
+# loaded once per dataset version, so renders never wait on the api and pick up a new version as soon as it's out:
+dataset = read_json(DATASET_MANIFEST, {'version': 0})
+dataset_version = dataset['version']
+
+
 @st.experimental_singleton()
-def load_class_data(file):
-    if file is not None:
-        classes_df = pd.read_csv(file, low_memory=False)
-        classes_df = classes_df.rename(columns={'difficulty_rating_avg': 'average difficulty rating',
-                                                'fitness_discipline_display_name': 'fitness discipline',
-                                                'difficulty_rating_count': 'difficulty rating count',
-                                                'original_air_time': 'premiere',
-                                                'overall_rating_avg': 'overall rating average',
-                                                'overall_rating_count': 'overall rating count',
-                                                'total_workouts': 'total user workouts'})
-        classes_df['duration secs'] = classes_df['duration']
-        classes_df['duration'] = [format_timespan(x) for x in sorted(classes_df['duration'])]
-        classes_df['premiere'] = [x.split(' ')[0] for x in classes_df['premiere']]
-        classes_df['average difficulty rating'] = classes_df['average difficulty rating'].apply(lambda x: round(x, 2))
-        classes_df['overall rating average'] = (classes_df['overall rating average'] * 100).apply(lambda x: round(x, 2))
-
-    return classes_df
-
-
-# load and preprocess class data:
-classes_df = load_class_data('./data/class_data/master_classes.csv')
+def load_class_database(dataset_version):
+    # the store version the class database holds (None until it is built). the dashboard only reads the database, which
+    # is built and kept up to date by the sync. the classes are queried from it an instructor at a time:
+    classes_version = read_class_database_version()
+
+    return classes_version
+
+
+# the classes and KPIs of the selected instructor, queried once per store version. the leaderboards are read as ranked
+# by the sync on every render (a few rows by primary key), since they are ranked again as the days move their cutoff:
+@st.experimental_memo(max_entries=64)
+def load_instructor_classes(instructor, classes_version):
+    return query_instructor_classes(instructor), query_instructor_kpis(instructor)
+
+
+@st.experimental_singleton()
+def load_instructors(file, dataset_version):
+    # the instructors saved by the sync (or the instructors file, until the sync has run):
+    instructors_df = pd.read_csv(file)
+
+    return instructors_df
+
+
+# the version loaded last, so that the data of older versions can be dropped from memory:
+@st.experimental_singleton()
+def loaded_dataset():
+    return {'version': dataset_version}
+
+
+if loaded_dataset()['version'] != dataset_version:
+    for loader in (load_class_database, load_instructors):
+        loader.clear()
+    loaded_dataset()['version'] = dataset_version
+
+# the class figures are cached under the version of the store the database holds:
+classes_fingerprint = load_class_database(dataset_version)
+render_timer.lap('class data')
+if classes_fingerprint is None:
+    st.info('The class data has not been built yet. Run `python sync_functions.py --init` (or start the sync) to '
+            'build it.')
+    st.stop()
 
 ins1, ins2, ins3, ins4 = st.columns([0.5, 1, 1, 1])
 
-# pull instructor data:
-instructors_df = get_instructors_data()
+# read instructor data:
+instructors_df = load_instructors(dataset.get('instructors_csv') or INSTRUCTORS_CSV, dataset_version)
 
 # plot data:
 with ins1:
@@ -275,53 +323,38 @@ with ins1:
     
 with ins2:
     # TODO: need a way to update metrics so we can avoid zeros in the rating counts
-    hero_df = classes_df[(classes_df['instructor_name'] == instructor) & (classes_df['overall rating count'] != 0)]
+    hero_df, hero_kpis = load_instructor_classes(instructor, classes_fingerprint)
+    instructor_leaderboards = query_instructor_leaderboards(instructor)
     diff_array = sorted(list(hero_df['duration']), reverse=True)
-    difficultyfig = count_histogram(hero_df, 'fitness discipline', 'duration', 650, 600, diff_array)
-    difficultyfig.update_layout(title_text='Count of Classes Instructed by Discipline')
+    difficultyfig = figure_cache.get_or_build(
+        (classes_fingerprint, 'hero classes by discipline', instructor),
+        lambda: count_histogram(hero_df, 'fitness discipline', 'duration', 650, 600, diff_array)
+        .update_layout(title_text='Count of Classes Instructed by Discipline'))
     st.plotly_chart(difficultyfig)
 
+hero_hover_data = ['title', 'premiere', 'average difficulty rating', 'difficulty rating count',
+                   'overall rating average', 'overall rating count', 'total user workouts']
+
 with ins3:
-    scatterfig2 = px.scatter(hero_df,
-                            x='overall rating average',
-                            y='overall rating count',
-                            size='total user workouts',
-                            marginal_x='box',
-                            marginal_y='box',
-                            color='fitness discipline',
-                            hover_data=['title', 'premiere', 'average difficulty rating', 'difficulty rating count',
-                                        'overall rating average', 'overall rating count', 'total user workouts'])
-    scatterfig2.update_layout(
-        title_text='Average User Rating of Classes Instructed',
-        autosize=False,
-        width=650,
-        height=600)
-    scatterfig2.update_xaxes(
-        tickvals=np.arange(0, 101))
-    scatterfig2.update_traces(notched=False, selector=dict(type='box'))
+    scatterfig2 = figure_cache.get_or_build(
+        (classes_fingerprint, 'hero ratings', instructor),
+        lambda: class_scatter(hero_df, x='overall rating average', y='overall rating count',
+                              size='total user workouts', color='fitness discipline', hover_data=hero_hover_data,
+                              title='Average User Rating of Classes Instructed', tickvals=np.arange(0, 101),
+                              w=650, h=600))
     st.plotly_chart(scatterfig2)
 
 with ins4:
-    scatterfig = px.scatter(hero_df,
-                            x='average difficulty rating',
-                            y='difficulty rating count',
-                            size='total user workouts',
-                            marginal_x='box',
-                            marginal_y='box',
-                            color='fitness discipline',
-                            hover_data=['title', 'premiere', 'average difficulty rating', 'difficulty rating count',
-                                        'overall rating average', 'overall rating count', 'total user workouts'])
-    scatterfig.update_layout(
-        title_text='Average Difficulty Rating of Classes Instructed',
-        autosize=False,
-        width=650,
-        height=600)
-    scatterfig.update_xaxes(
-        tickvals=np.arange(0, 11))
-    scatterfig.update_traces(notched=False, selector=dict(type='box'))
+    scatterfig = figure_cache.get_or_build(
+        (classes_fingerprint, 'hero difficulty', instructor),
+        lambda: class_scatter(hero_df, x='average difficulty rating', y='difficulty rating count',
+                              size='total user workouts', color='fitness discipline', hover_data=hero_hover_data,
+                              title='Average Difficulty Rating of Classes Instructed', tickvals=np.arange(0, 11),
+                              w=650, h=600))
     st.plotly_chart(scatterfig)
 
 st.markdown('---')
+render_timer.lap('hero')
 
 ########################################################################################################################
 # Instructor KPIs:
@@ -330,30 +363,31 @@ st.markdown('---')
 inskpi0, inskpi1, inskpi2, inskpi3, inskpi4, inskpi5, inskpi6 = st.columns([0.2, 1, 1, 1, 1, 1, 1])
 
 with inskpi1:
-    total_instructed = '{:,}'.format(len(hero_df['instructor_id']))
+    total_instructed = '{:,}'.format(hero_kpis['total classes'])
     inskpi1.metric(label='Total Classes Instructed:', value=total_instructed)
 
 with inskpi2:
-    total_user_workouts = '{:,}'.format(hero_df['total user workouts'].sum()) + '+'
+    total_user_workouts = '{:,.0f}'.format(hero_kpis['total user workouts']) + '+'
     inskpi2.metric(label='Total User Workouts:', value=total_user_workouts)
 
 with inskpi3:
-    median_quality_rating = '{:.2f}'.format(hero_df['overall rating average'].median())
+    median_quality_rating = '{:.2f}'.format(hero_kpis['median rating'])
     inskpi3.metric(label='Median Rating Across All Classes:', value=median_quality_rating)
 
 with inskpi4:
-    avg_rating_per_class = '{:,.0f}'.format(hero_df['overall rating count'].sum() / len(hero_df['instructor_id']))
+    avg_rating_per_class = '{:,.0f}'.format(hero_kpis['ratings per class'])
     inskpi4.metric(label='Average Number of Rating per Class:', value=avg_rating_per_class)
 
 with inskpi5:
-    median_difficulty_rating = '{:.2f}'.format(hero_df['average difficulty rating'].median())
+    median_difficulty_rating = '{:.2f}'.format(hero_kpis['median difficulty rating'])
     inskpi5.metric(label='Median Difficulty Rating:', value=median_difficulty_rating)
 
 with inskpi6:
-    total_hours_instructed = '{:,.1f}'.format(hero_df['duration secs'].sum() / 3600) + ' hours'
+    total_hours_instructed = '{:,.1f}'.format(hero_kpis['total hours']) + ' hours'
     inskpi6.metric(label='Total Hours of Instruction:', value=total_hours_instructed)
 
 st.markdown('---')
+render_timer.lap('instructor kpis')
 
 ########################################################################################################################
 # Instructor Best and Worst classes:
@@ -361,57 +395,25 @@ st.markdown('---')
 # ride images:
 insimages0, insimages1, insimages2, insimages3, insimages4 = st.columns([0.2, 1, 1, 1, 1])
 
-# lag ratings dataframe by one month to give classes a chance to rack up ratings:
-ratings_df = hero_df[pd.to_datetime(hero_df['premiere']) < pd.to_datetime(datetime.today() - timedelta(days=15))]
-
-with insimages1:
-    most_rated_ride_img = ratings_df.loc[ratings_df['overall rating count'] == ratings_df['overall rating count'].max(),
-                                         'image_url'].values[0]
-    most_rated_ride_title = ratings_df.loc[ratings_df['overall rating count'] == ratings_df['overall rating count'].max(),
-                                           'title'].values[0]
-    st.markdown('Most Rated Class: ' + most_rated_ride_title)
-    most_rated_ride_premiere = ratings_df.loc[ratings_df['overall rating count'] == ratings_df['overall rating count'].max(),
-                                           'premiere'].values[0]
-    most_rated_ride_count = '{:,}'.format(ratings_df['overall rating count'].max()) + ' ratings'
-    st.image(most_rated_ride_img, width=400)
-    st.markdown('premiered on ' + most_rated_ride_premiere + " (" + most_rated_ride_count + ")")
-
-with insimages2:
-    highest_rated_ride_img = ratings_df.loc[ratings_df['overall rating average'] ==
-                                            ratings_df['overall rating average'].max(), 'image_url'].values[0]
-    highest_rated_ride_title = ratings_df.loc[ratings_df['overall rating average'] ==
-                                              ratings_df['overall rating average'].max(), 'title'].values[0]
-    st.markdown('Highest Rated Class: ' + highest_rated_ride_title)
-    highest_rated_ride_premiere = ratings_df.loc[ratings_df['overall rating average'] ==
-                                                 ratings_df['overall rating average'].max(), 'premiere'].values[0]
-    highest_rated_ride_count = '{:,}'.format(ratings_df['overall rating average'].max()) + ' average rating'
-    st.image(highest_rated_ride_img, width=400)
-    st.markdown('premiered on ' + highest_rated_ride_premiere + " (" + highest_rated_ride_count + ")")
-
-with insimages3:
-    most_difficult_ride_img = ratings_df.loc[ratings_df['average difficulty rating'] ==
-                                             ratings_df['average difficulty rating'].max(), 'image_url'].values[0]
-    most_difficult_ride_title = ratings_df.loc[ratings_df['average difficulty rating'] ==
-                                               ratings_df['average difficulty rating'].max(), 'title'].values[0]
-    st.markdown('Most Difficult Class: ' + most_difficult_ride_title)
-    most_difficult_ride_premiere = ratings_df.loc[ratings_df['average difficulty rating'] ==
-                                                  ratings_df['average difficulty rating'].max(), 'premiere'].values[0]
-    most_difficult_ride_count = '{:,}'.format(ratings_df['average difficulty rating'].max()) + \
-                                ' average difficulty rating'
-    st.image(most_difficult_ride_img, width=400)
-    st.markdown('premiered on ' + most_difficult_ride_premiere + " (" + most_difficult_ride_count + ")")
-
-with insimages4:
-    lowest_rated_ride_img = ratings_df.loc[ratings_df['overall rating average'] ==
-                                            ratings_df['overall rating average'].min(), 'image_url'].values[0]
-    lowest_rated_ride_title = ratings_df.loc[ratings_df['overall rating average'] ==
-                                              ratings_df['overall rating average'].min(), 'title'].values[0]
-    st.markdown('Lowest Rated Class: ' + lowest_rated_ride_title)
-    lowest_rated_ride_premiere = ratings_df.loc[ratings_df['overall rating average'] ==
-                                                 ratings_df['overall rating average'].min(), 'premiere'].values[0]
-    lowest_rated_ride_count = '{:,}'.format(ratings_df['overall rating average'].min()) + ' average rating'
-    st.image(lowest_rated_ride_img, width=400)
-    st.markdown('premiered on ' + lowest_rated_ride_premiere + " (" + lowest_rated_ride_count + ")")
+# leaderboards are lagged by 15 days to give classes a chance to rack up ratings:
+leaderboard_cards = [(insimages1, 'Most Rated Class: ', 'most rated', ' ratings'),
+                     (insimages2, 'Highest Rated Class: ', 'highest rated', ' average rating'),
+                     (insimages3, 'Most Difficult Class: ', 'most difficult', ' average difficulty rating'),
+                     (insimages4, 'Lowest Rated Class: ', 'lowest rated', ' average rating')]
+
+for column, label, leaderboard, value_label in leaderboard_cards:
+    with column:
+        top_df = instructor_leaderboards.get(leaderboard)
+        if top_df is None or top_df.empty:
+            continue
+        top_class = top_df.iloc[0]
+        st.markdown(label + top_class['title'])
+        st.image(top_class['image_url'], width=400)
+        st.markdown('premiered on ' + top_class['premiere'] + " (" + '{:,}'.format(top_class['value']) + value_label + ")")
+
+with st.expander("Top 10 classes:"):
+    top_leaderboard = st.selectbox('Leaderboard: ', list(LEADERBOARDS), index=0)
+    st.dataframe(instructor_leaderboards.get(top_leaderboard, pd.DataFrame()).drop(columns='image_url', errors='ignore'))
 
 # with st.expander("Note:"):
 #     st.markdown('The data for this subsection has been "lagged" by 30 days to allow classes to rack up ratings and '
@@ -419,6 +421,7 @@ with insimages4:
 #                 'up to one month (from today) are used to find the highest and lowest rated classes. This avoids '
 #                 'having classes with few but inflated ratings, and other with few but heavily penalized scores.')
 st.markdown('---')
+render_timer.lap('leaderboards')
 with st.expander("COMING SOON:"):
     st.markdown("I'm looking to add two more sections to this project: one on publicly available instructor workouts"
                 " (classes they've taken as opposed to instructed) so that users can see how they stack up against "
@@ -426,3 +429,26 @@ with st.expander("COMING SOON:"):
                 "(highest rated classes overall, total number of user workouts, etc. With all the talk about a "
                 "possible acquisition by bigger brands, it'd be interesting to see what the available data says "
                 "they'd be getting in terms of impressions, etc...")
+
+# chart cache usage (hit rate and memory), for keeping an eye on the cache bounds:
+with st.sidebar.expander("Chart cache"):
+    figure_cache_stats = figure_cache.stats()
+    st.metric('hit rate', '{:.0%}'.format(figure_cache_stats['hit rate']))
+    st.metric('memory', '{:,.1f} MB'.format(figure_cache_stats['bytes'] / 1024 ** 2))
+    st.json(figure_cache_stats)
+
+# debug panel with the timings of this render, the api request counters and the cache stats:
+if INSTRUMENTATION_ENABLED:
+    cache_stats = {'figure cache': figure_cache_stats,
+                   'response cache': response_cache_stats()}
+    with st.sidebar.expander("Debug timings", expanded=True):
+        st.markdown('**This render (secs):**')
+        st.table(pd.Series(render_timer.laps, name='secs').round(4))
+        snapshot = metrics.snapshot()
+        st.markdown('**All renders:**')
+        st.json(snapshot['sections'])
+        st.markdown('**API requests:**')
+        st.json(snapshot['endpoints'])
+        st.markdown('**Caches:**')
+        st.json(cache_stats)
+    render_timer.finish(caches=cache_stats)
@@ -0,0 +1,206 @@
+import argparse
+import heapq
+import json
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from api_functions import *
+from instrumentation_functions import log_event
+
+# background sync of the api data, run as its own process next to the dashboard:
+#   python sync_functions.py            # runs every job on its schedule until stopped (SIGINT/SIGTERM)
+#   python sync_functions.py --once     # runs the jobs that are due, then exits (i.e. from cron)
+#   python sync_functions.py --run classes
+#   python sync_functions.py --status
+#   python sync_functions.py --init     # builds the class store and database from the master csv, then exits
+#   python sync_functions.py --import-classes data/class_data/master_classes.csv
+# every job takes its own file lock, so a job never runs twice at the same time, whether from two daemons or a daemon
+# and a manual run. after every successful job, a new dataset version is published (see publish_dataset) for the
+# dashboard to pick up, so that page renders only ever read local files.
+
+SYNC_DIR = './data/sync/'
+SYNC_STATE_PATH = SYNC_DIR + 'state.json'
+# list of instructors as last fetched by the sync, read by the dashboard instead of calling the api:
+INSTRUCTORS_SNAPSHOT_CSV = './data/instructor_data/instructors_snapshot.csv'
+# failed jobs are retried after RETRY_AFTER_SECS, doubling with every consecutive failure (up to the job's interval):
+RETRY_AFTER_SECS = 5 * 60
+
+
+# fetches the instructors list from the api and saves it as the snapshot read by the dashboard:
+def snapshot_instructors():
+    get_instructors_data.cache_clear()
+    write_csv_atomically(get_instructors_data(), INSTRUCTORS_SNAPSHOT_CSV)
+
+
+# the sync jobs: name -> (function, interval between runs in seconds):
+SYNC_JOBS = {
+    'instructors': (snapshot_instructors, 24 * 3600),
+    'classes': (get_class_diff, 6 * 3600),
+    'instructor workouts': (update_instructor_workouts, 24 * 3600),
+}
+
+
+# holds a named sync lock (a file lock, so it is shared by every process). with blocking=False, yields False right away
+# instead of waiting when the lock is taken:
+@contextmanager
+def sync_lock(name, blocking=True):
+    os.makedirs(SYNC_DIR, exist_ok=True)
+    with file_lock(os.path.join(SYNC_DIR, name.replace(' ', '_') + '.lock'), blocking) as acquired:
+        yield acquired
+
+
+# publishes a new dataset version: the class store version and instructors snapshot the dashboard should read:
+def publish_dataset():
+    with sync_lock('publish'):
+        dataset = read_json(DATASET_MANIFEST, {'version': 0})
+        manifest = read_manifest() or {}
+        dataset = {'version': dataset['version'] + 1,
+                   'published_at': time.time(),
+                   'class_store_version': manifest.get('version'),
+                   'instructors_csv': INSTRUCTORS_SNAPSHOT_CSV if os.path.exists(INSTRUCTORS_SNAPSHOT_CSV) else None}
+        write_json_atomically(dataset, DATASET_MANIFEST)
+    return dataset
+
+
+def read_job_state(job_name):
+    return read_json(SYNC_STATE_PATH, {}).get(job_name, {})
+
+
+# updates the saved state (schedule and last outcome) of a job:
+def update_job_state(job_name, **fields):
+    with sync_lock('state'):
+        state = read_json(SYNC_STATE_PATH, {})
+        state[job_name] = dict(state.get(job_name, {}), **fields)
+        write_json_atomically(state, SYNC_STATE_PATH)
+
+
+def log_sync(message):
+    print(time.strftime('%Y-%m-%d %H:%M:%S') + ' ' + message, flush=True)
+
+
+# runs a job now and schedules its next run. returns True when it succeeded, False when it failed and None when it was
+# skipped because it is already running elsewhere:
+def run_job(job_name):
+    func, interval = SYNC_JOBS[job_name]
+    with sync_lock(job_name, blocking=False) as acquired:
+        if not acquired:
+            log_sync(job_name + ': already running, skipped')
+            return None
+
+        started = time.time()
+        log_sync(job_name + ': started')
+        update_job_state(job_name, status='running', started_at=started)
+        try:
+            func()
+        except Exception as e:
+            failures = read_job_state(job_name).get('failures', 0) + 1
+            update_job_state(job_name, status='failed', error=repr(e), failures=failures, finished_at=time.time(),
+                             next_run=time.time() + min(interval, RETRY_AFTER_SECS * 2 ** (failures - 1)))
+            log_sync(job_name + ': failed\n' + traceback.format_exc())
+            log_event('sync job', job=job_name, status='failed', error=repr(e))
+            return False
+
+        finished = time.time()
+        update_job_state(job_name, status='ok', error=None, failures=0, finished_at=finished, last_success=finished,
+                         secs=round(finished - started, 3), next_run=started + interval)
+
+    dataset = publish_dataset()
+    log_sync(job_name + ': done in ' + str(round(finished - started, 1)) + 's, published dataset version ' +
+             str(dataset['version']))
+    log_event('sync job', job=job_name, status='ok', secs=round(finished - started, 3), dataset=dataset)
+    return True
+
+
+# runs the jobs on their schedules: a queue of (next run, job) ordered by next run, seeded from the saved state so
+# that schedules survive restarts. stop() (i.e. on SIGTERM) lets the running job finish, then stops:
+class SyncDaemon:
+    def __init__(self, jobs=None):
+        self.jobs = list(jobs or SYNC_JOBS)
+        self.stopping = threading.Event()
+
+    def stop(self, *args):
+        self.stopping.set()
+
+    # with once=True, runs the jobs that are due and returns instead of waiting for the next one:
+    def run(self, once=False):
+        # jobs due at the same time run in the order they are listed in SYNC_JOBS:
+        queue = [(read_job_state(job_name).get('next_run', 0), position, job_name)
+                 for position, job_name in enumerate(self.jobs)]
+        heapq.heapify(queue)
+        while queue and not self.stopping.is_set():
+            next_run, position, job_name = queue[0]
+            wait = next_run - time.time()
+            if wait > 0:
+                if once:
+                    break
+                self.stopping.wait(wait)
+                continue
+
+            heapq.heappop(queue)
+            if run_job(job_name) is None:
+                # running elsewhere, check back once that run is likely done:
+                next_run = time.time() + RETRY_AFTER_SECS
+            else:
+                next_run = read_job_state(job_name)['next_run']
+            heapq.heappush(queue, (next_run, position, job_name))
+
+
+# builds the class store from the master csv (the first time only, see ensure_class_store) and the class database read
+# by the dashboard, then publishes them. the classes job does the same before its first sync, so this is only needed to
+# get the dashboard going without the api:
+def init_class_data():
+    with sync_lock('classes'):
+        ensure_class_store()
+        ensure_class_database()
+    dataset = publish_dataset()
+    log_sync('init: class data ready, published dataset version ' + str(dataset['version']))
+
+
+# merges the classes of a csv into the class store (a one-time step, i.e. for a master file saved before the store was
+# built), then brings the class database up to date and publishes the result:
+def import_classes(csv_path):
+    with sync_lock('classes'):
+        imported = import_class_csv(csv_path)
+        ensure_class_database()
+    dataset = publish_dataset()
+    log_sync('classes import: ' + str(imported) + ' classes imported from ' + csv_path + ', published dataset version ' +
+             str(dataset['version']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Syncs the classes and instructor data from the Peloton API.')
+    parser.add_argument('--once', action='store_true', help='run the jobs that are due, then exit')
+    parser.add_argument('--run', choices=list(SYNC_JOBS), help='run a job now, then exit')
+    parser.add_argument('--jobs', nargs='+', choices=list(SYNC_JOBS), help='only schedule these jobs')
+    parser.add_argument('--status', action='store_true', help='print the state of every job, then exit')
+    parser.add_argument('--init', action='store_true',
+                        help='build the class store and database from the master csv, then exit')
+    parser.add_argument('--import-classes', metavar='CSV',
+                        help='merge the classes of a csv into the class store, then exit')
+    args = parser.parse_args(argv)
+
+    if args.status:
+        print(json.dumps({'jobs': read_json(SYNC_STATE_PATH, {}), 'dataset': read_json(DATASET_MANIFEST)}, indent=2))
+        return 0
+    if args.init:
+        init_class_data()
+        return 0
+    if args.import_classes:
+        import_classes(args.import_classes)
+        return 0
+    if args.run:
+        return 0 if run_job(args.run) is not False else 1
+
+    daemon = SyncDaemon(args.jobs)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    daemon.run(once=args.once)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())